@@ -1,9 +1,22 @@
 # admin.py
-from flask import request, jsonify
-from werkzeug.security import generate_password_hash,check_password_hash
-from auth import admin_required
-from db_init import get_db
+from flask import request, jsonify, Response
+from auth import STREAM_TICKET_SECONDS, admin_required, authenticate, bump_token_version, create_stream_ticket, issue_tokens, other_admin_exists, token_cache_stats, token_version_current
+from events import bus, publish
+from hashing import hash_password, hash_passwords, verify_password, hashing_stats
+from db_init import get_db, get_change_version, get_dashboard_stats, get_pool, pool_stats
+from throttle import throttle_stats
+from write_behind import last_login_buffer, refresh_token_buffer
+from login_log import GRANULARITIES, dormancy, login_activity, login_event_log
+from user_cache import get_user, invalidate_user, user_cache_stats
+from metrics import render as render_metrics
+from http_cache import conditional_json, make_etag
+import base64
 import datetime
+import difflib
+import json
+import os
+import secrets
+import sqlite3
 
 # ---------- Admin Endpoints ----------
 
@@ -25,12 +38,11 @@ def admin_change_credentials():
     db = get_db()
     
     # Verify current password and get user info
-    cur = db.execute("SELECT password, username, is_admin FROM users WHERE slno = ?", (user_id,))
-    row = cur.fetchone()
+    row = get_user(db, user_id)
     if not row:
         return jsonify({"error": "user not found"}), 404
 
-    if not check_password_hash(row["password"], current_password):
+    if not verify_password(row["password"], current_password):
         return jsonify({"error": "current password is incorrect"}), 401
 
     # If changing username
@@ -41,11 +53,8 @@ def admin_change_credentials():
             return jsonify({"error": "username already taken"}), 400
         
         # For admin, ensure we maintain only one admin
-        if row["is_admin"]:
-            cur = db.execute("SELECT slno FROM users WHERE is_admin = 1 AND slno != ?", (user_id,))
-            other_admins = cur.fetchall()
-            if other_admins:
-                return jsonify({"error": "Cannot change admin credentials when other admins exist"}), 400
+        if row["is_admin"] and other_admin_exists(db, user_id):
+            return jsonify({"error": "Cannot change admin credentials when other admins exist"}), 400
         
         db.execute("UPDATE users SET username = ? WHERE slno = ?", (new_username, user_id))
 
@@ -53,12 +62,18 @@ def admin_change_credentials():
     if new_password:
         db.execute(
             "UPDATE users SET password = ?, reset_password_time = ? WHERE slno = ?",
-            (generate_password_hash(new_password), datetime.datetime.now(), user_id)
+            (hash_password(new_password), datetime.datetime.now(), user_id)
         )
 
+    bump_token_version(db, user_id)
     db.commit()
+    invalidate_user(user_id, row["username"])
+    publish("user.credentials_changed", user_id=user_id, username=new_username or row["username"])
     
-    return jsonify({"message": "credentials updated successfully"})
+    return jsonify({
+        "message": "credentials updated successfully",
+        **issue_tokens(db, user_id)
+    })
 
 @admin_required
 def admin_create_user():
@@ -78,27 +93,58 @@ def admin_create_user():
         return jsonify({"error": "username already exists"}), 400
 
     # Create new user (non-admin by default)
-    hashed_password = generate_password_hash(password)
+    hashed_password = hash_password(password)
     db.execute(
         "INSERT INTO users (username, password, is_admin, must_reset) VALUES (?, ?, ?,?)",
         (username, hashed_password, False, True)
     )
     db.commit()
+    publish("user.created", username=username)
     
     return jsonify({"message": "user created successfully"}), 201
 
 @admin_required
 def admin_forgot_requests():
+    """Pending forgot-password requests.
+
+    With `since=<cursor>` only requests created, changed or resolved after the
+    cursor are returned (any status), so the client can patch its local list.
+    """
+    since = request.args.get("since")
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({"error": "since must be an integer cursor"}), 400
+
     db = get_db()
-    cur = db.execute("""
-        SELECT slno as user_id, username, forgot_request_time as requested_at, 
-               forgot_request_status as status, admin_note
-        FROM users 
-        WHERE forgot_request_status = 'pending'
-        ORDER BY forgot_request_time DESC
-    """)
-    rows = [dict(r) for r in cur.fetchall()]
-    return jsonify({"requests": rows})
+    users_version, _ = get_change_version(db, "users")
+    version, updated_at = get_change_version(db, "forgot_requests")
+
+    def build_payload():
+        if since is None:
+            cur = db.execute("""
+                SELECT slno as user_id, username, forgot_request_time as requested_at, 
+                       forgot_request_status as status, admin_note
+                FROM users 
+                WHERE forgot_request_status = 'pending'
+                ORDER BY forgot_request_time DESC
+            """)
+        else:
+            cur = db.execute("""
+                SELECT slno as user_id, username, forgot_request_time as requested_at,
+                       forgot_request_status as status, admin_note
+                FROM users
+                WHERE row_version > ? AND forgot_request_status IS NOT NULL
+                ORDER BY row_version
+            """, (since,))
+        rows = [dict(r) for r in cur.fetchall()]
+        return {"requests": rows, "cursor": users_version}
+
+    # A delta answer also depends on the users cursor it hands back
+    etag_parts = (version,) if since is None else (version, since, users_version)
+    return conditional_json(build_payload, make_etag("forgot_requests", *etag_parts), updated_at,
+                            rows_key="requests")
 
 @admin_required
 def admin_reset_user_password():
@@ -111,26 +157,595 @@ def admin_reset_user_password():
         return jsonify({"error": "user_id and new_password required"}), 400
 
     db = get_db()
-    cur = db.execute("SELECT slno FROM users WHERE slno = ?", (user_id,))
-    if not cur.fetchone():
+    user = get_user(db, user_id)
+    if not user:
         return jsonify({"error": "user not found"}), 404
+    user_id = user["slno"]  # the cache is keyed by the integer id, not the id as sent
 
     db.execute(
         "UPDATE users SET password = ?, forgot_request_status = 'resolved',must_reset = TRUE, admin_note = ? WHERE slno = ?",
-        (generate_password_hash(new_password), note, user_id)
+        (hash_password(new_password), note, user_id)
     )
+    bump_token_version(db, user_id)  # sign the user out everywhere
     db.commit()
+    invalidate_user(user_id)
+    publish("forgot_request.resolved", user_id=user_id)
     return jsonify({"message": "user password reset by admin"})
 
+BATCH_RESET_MAX = int(os.getenv("BATCH_RESET_MAX", "1000"))
+GENERATED_PASSWORD_BYTES = int(os.getenv("GENERATED_PASSWORD_BYTES", "12"))
+
+def _existing_user_ids(db, user_ids):
+    found = {}
+    ids = list(user_ids)
+    # Stay well under SQLite's bound-parameter limit
+    for start in range(0, len(ids), 500):
+        part = ids[start:start + 500]
+        placeholders = ",".join("?" * len(part))
+        cur = db.execute(f"SELECT slno, username FROM users WHERE slno IN ({placeholders})", part)
+        found.update((r["slno"], r["username"]) for r in cur.fetchall())
+    return found
+
+def _batch_reset_targets(db, data):
+    """[(user_id, password or None)] from `users`, `user_ids` or `filter`"""
+    if data.get("users") is not None:
+        entries = data["users"]
+        if not isinstance(entries, list) or not all(isinstance(e, dict) for e in entries):
+            raise ValueError("users must be a list of {user_id, new_password} objects")
+        targets = [(e.get("user_id"), e.get("new_password") or None) for e in entries]
+    elif data.get("user_ids") is not None:
+        if not isinstance(data["user_ids"], list):
+            raise ValueError("user_ids must be a list")
+        targets = [(user_id, None) for user_id in data["user_ids"]]
+    elif isinstance(data.get("filter"), dict):
+        clauses, params = build_user_filters(data["filter"])
+        if not clauses:
+            raise ValueError("filter must restrict the users it selects")
+        cur = db.execute(
+            f"SELECT slno FROM users WHERE {' AND '.join(clauses)} ORDER BY slno LIMIT ?",
+            params + [BATCH_RESET_MAX + 1],
+        )
+        targets = [(r["slno"], None) for r in cur.fetchall()]
+    else:
+        raise ValueError("one of users, user_ids or filter is required")
+
+    if not targets:
+        raise ValueError("no users selected")
+    if len(targets) > BATCH_RESET_MAX:
+        raise ValueError(f"at most {BATCH_RESET_MAX} users per batch")
+    # bool is an int subclass; JSON true must not become user 1
+    if not all(isinstance(user_id, int) and not isinstance(user_id, bool) for user_id, _ in targets):
+        raise ValueError("user ids must be integers")
+    if not all(password is None or isinstance(password, str) for _, password in targets):
+        raise ValueError("new_password must be a string")
+    return targets
+
+@admin_required
+def admin_batch_reset_passwords():
+    """Reset many users' passwords in one request.
+
+    Select users with `users` ([{user_id, new_password}]), `user_ids` or a
+    `filter` using the /api/users filter names (e.g. {"forgot_request_status":
+    "pending"}). Users without a given password get a generated one, returned
+    once in the results. Hashing runs across the hashing workers, then every
+    update is applied in a single transaction, with the same effect as
+    admin_reset_user_password for each user.
+    """
+    data = request.json or {}
+    note = data.get("admin_note", "")
+    db = get_db()
+
+    try:
+        targets = _batch_reset_targets(db, data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    results = []
+    planned = {}
+    seen = set()
+    for user_id, password in targets:
+        if user_id in seen:
+            results.append({"user_id": user_id, "status": "duplicate"})
+            continue
+        seen.add(user_id)
+        if user_id == request.user["user_id"]:
+            results.append({"user_id": user_id, "status": "skipped",
+                            "error": "use change_credentials for your own account"})
+        else:
+            planned[user_id] = password
+
+    known = _existing_user_ids(db, planned)
+    generated = {}
+    for user_id in planned:
+        if user_id not in known:
+            continue
+        if planned[user_id] is None:
+            planned[user_id] = generated[user_id] = secrets.token_urlsafe(GENERATED_PASSWORD_BYTES)
+    hashed_ids = [user_id for user_id in planned if user_id in known]
+    hashes = dict(zip(hashed_ids, hash_passwords([planned[i] for i in hashed_ids])))
+
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        # Users deleted while hashing are reported instead of silently skipped
+        present = _existing_user_ids(db, hashes)
+        db.executemany(
+            "UPDATE users SET password = ?, forgot_request_status = 'resolved', must_reset = TRUE, "
+            "admin_note = ?, token_version = token_version + 1 WHERE slno = ?",
+            [(hashes[user_id], note, user_id) for user_id in hashes if user_id in present],
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    for user_id in present:
+        invalidate_user(user_id)
+
+    for user_id in planned:
+        if user_id not in present:
+            results.append({"user_id": user_id, "status": "not_found"})
+            continue
+        result = {"user_id": user_id, "username": present[user_id], "status": "reset"}
+        if user_id in generated:
+            result["new_password"] = generated[user_id]
+        results.append(result)
+
+    summary = {status: sum(r["status"] == status for r in results)
+               for status in ("reset", "not_found", "duplicate", "skipped")}
+    if summary["reset"]:
+        publish("forgot_request.resolved", user_ids=[r["user_id"] for r in results if r["status"] == "reset"])
+    return jsonify({"results": results, "summary": summary})
+
+@admin_required
+def admin_stats():
+    """Dashboard summary counts, read from trigger-maintained counters"""
+    return jsonify({"stats": get_dashboard_stats(get_db())})
+
+@admin_required
+def admin_login_activity():
+    """Login successes/failures per `granularity` (hour or day) over `days`, from the rollups"""
+    granularity = request.args.get("granularity", "hour")
+    if granularity not in GRANULARITIES:
+        return jsonify({"error": f"granularity must be one of: {', '.join(GRANULARITIES)}"}), 400
+    try:
+        days = int(request.args["days"]) if request.args.get("days") else None
+    except ValueError:
+        return jsonify({"error": "days must be an integer"}), 400
+    if days is not None and days < 1:
+        return jsonify({"error": "days must be positive"}), 400
+    return jsonify({"granularity": granularity, "series": login_activity(get_db(), granularity, days)})
+
+@admin_required
+def admin_dormant_users():
+    """How many users have not logged in for 30/90/180 days, or never"""
+    return jsonify({"dormancy": dormancy(get_db())})
+
+@admin_required
+def admin_db_pool_stats():
+    """Connection pool counters, for sizing DB_POOL_SIZE under load"""
+    return jsonify({"pool": pool_stats()})
+
+@admin_required
+def admin_throttle_stats():
+    """Login limiter counters, to watch brute-force pressure"""
+    return jsonify({"throttle": throttle_stats()})
+
+@admin_required
+def admin_metrics():
+    """Prometheus text exposition of request, SQL and subsystem metrics"""
+    pool = pool_stats()
+    hashing = hashing_stats()
+    tokens = token_cache_stats()
+    logins = last_login_buffer.stats()
+    refresh_tokens = refresh_token_buffer.stats()
+    limits = throttle_stats()
+    events = bus.stats()
+    users = user_cache_stats()
+    login_log = login_event_log.stats()
+
+    extra = [
+        ("auf_db_pool_connections", "gauge", "Pooled SQLite connections by state.", ("state",),
+         {("in_use",): pool["in_use"], ("idle",): pool["idle"]}),
+        ("auf_db_pool_max_size", "gauge", "Configured pool size.", (), {(): pool["max_size"]}),
+        ("auf_db_pool_events_total", "counter", "Pool events since start.", ("event",),
+         {(k,): pool[k] for k in ("created", "acquired", "thread_reuse", "waits", "timeouts",
+                                  "health_check_failures")}),
+        ("auf_hashing_in_flight", "gauge", "Hash jobs admitted and not yet finished.", (),
+         {(): hashing["in_flight"]}),
+        ("auf_hashing_capacity", "gauge", "Hash jobs admitted at once before rejecting.", (),
+         {(): hashing["capacity"]}),
+        ("auf_hashing_events_total", "counter", "Hashing service events since start.", ("event",),
+         {(k,): hashing[k] for k in ("submitted", "rejected", "rehashed", "pool_restarts",
+                                     "batch_hashed")}),
+        ("auf_token_cache_entries", "gauge", "Verified tokens cached.", (), {(): tokens["size"]}),
+        ("auf_token_cache_events_total", "counter", "Token cache lookups and evictions.", ("event",),
+         {(k,): tokens[k] for k in ("hits", "misses", "evictions")}),
+        ("auf_user_cache_entries", "gauge", "Cached user records.", ("index",),
+         {(index,): s["size"] for index, s in users.items()}),
+        ("auf_user_cache_events_total", "counter", "User cache lookups and evictions.", ("index", "event"),
+         {(index, k): s[k] for index, s in users.items() for k in ("hits", "misses", "evictions")}),
+        ("auf_last_login_pending", "gauge", "Buffered last_login_time updates.", (),
+         {(): logins["pending"]}),
+        ("auf_last_login_events_total", "counter", "Write-behind buffer activity.", ("event",),
+         {(k,): logins[k] for k in ("recorded", "flushes", "rows_written", "flush_errors")}),
+        ("auf_refresh_token_pending", "gauge", "Buffered login refresh tokens.", (),
+         {(): refresh_tokens["pending"]}),
+        ("auf_refresh_token_events_total", "counter", "Refresh token write-behind activity.", ("event",),
+         {(k,): refresh_tokens[k] for k in ("recorded", "overflow", "dropped", "flushes", "rows_written",
+                                            "flush_errors")}),
+        ("auf_login_log_pending", "gauge", "Login events waiting to be written.", (),
+         {(): login_log["pending"]}),
+        ("auf_login_log_events_total", "counter", "Login event log activity.", ("event",),
+         {(k,): login_log[k] for k in ("recorded", "dropped", "flushes", "rows_written",
+                                       "flush_errors", "rows_compacted")}),
+        ("auf_events_subscribers", "gauge", "Open admin SSE streams.", (), {(): events["subscribers"]}),
+        ("auf_events_published_total", "counter", "Events published to the admin stream.", (),
+         {(): events["published"]}),
+        ("auf_throttle_tracked_keys", "gauge", "Keys tracked by the login limiter.", ("scope",),
+         {(scope,): s["tracked_keys"] for scope, s in limits.items()}),
+        ("auf_throttle_events_total", "counter", "Login limiter decisions.", ("scope", "event"),
+         {(scope, k): s[k] for scope, s in limits.items()
+          for k in ("allowed", "rate_limited", "locked_out", "lockouts")}),
+    ]
+    return Response(render_metrics(extra), mimetype="text/plain; version=0.0.4")
+
+@admin_required
+def admin_events_ticket():
+    """Ticket for opening /api/admin/events, valid for STREAM_TICKET_SECONDS"""
+    return jsonify({
+        "ticket": create_stream_ticket(request.user, "admin_events"),
+        "expires_in": STREAM_TICKET_SECONDS,
+    })
+
+def admin_events():
+    """Server-Sent Events feed of forgot-request and user changes.
+
+    Authenticated inside the view because EventSource cannot send an
+    Authorization header: browsers pass ?ticket= from
+    /api/admin/events/ticket instead, so no access token ends up in URLs or
+    access logs. The token version is re-checked every heartbeat, so a
+    revoked session loses its stream. Resume with the Last-Event-ID header
+    (sent automatically on reconnect) or ?last_event_id=.
+    """
+    error = authenticate(admin=True, ticket_purpose="admin_events")
+    if error:
+        return error
+    payload = request.user
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+
+    def authorized():
+        # Runs outside the request, so it borrows a pooled connection briefly
+        with get_pool().connection() as db:
+            return token_version_current(payload, db)
+
+    # Not stream_with_context: the open stream must not pin a DB connection
+    response = Response(bus.stream(last_event_id, authorized), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+# ---------- User listing (keyset pagination) ----------
+
+USERS_PAGE_DEFAULT = int(os.getenv("USERS_PAGE_DEFAULT", "100"))
+USERS_PAGE_MAX = int(os.getenv("USERS_PAGE_MAX", "1000"))
+
+USER_COLUMNS = (
+    "slno", "username", "is_admin", "must_reset", "reset_requested",
+    "last_login_time", "reset_password_time", "created_at",
+    "forgot_request_status", "forgot_request_time", "admin_note",
+)
+
+# Columns the list can be ordered by; each one is backed by an index in db_init
+# (slno is the rowid, so every secondary index already ends in slno).
+SORTABLE_COLUMNS = ("slno", "username", "created_at", "last_login_time", "forgot_request_time")
+
+# Equality filters and the sorts a composite index in db_init covers for them;
+# other pairs would sort every matching row per page, so they are rejected
+FILTER_SORTS = {
+    "is_admin": SORTABLE_COLUMNS,
+    "must_reset": SORTABLE_COLUMNS,
+    "forgot_request_status": ("slno", "forgot_request_time"),
+}
+
+def _parse_bool(value):
+    """Query-string flag, or a JSON true/false/1/0 from a request body"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if not isinstance(value, str):
+        raise ValueError(f"invalid boolean value: {value}")
+    value = value.strip().lower()
+    if value in ("1", "true", "yes"):
+        return True
+    if value in ("0", "false", "no"):
+        return False
+    raise ValueError(f"invalid boolean value: {value}")
+
+def _encode_cursor(values):
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("invalid cursor")
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError("invalid cursor")
+    last_value, last_slno = values
+    if (isinstance(last_value, (bool, list, dict))
+            or not isinstance(last_slno, int) or isinstance(last_slno, bool)):
+        raise ValueError("invalid cursor")
+    return values
+
+def build_user_filters(args):
+    """Translate query-string filters into a WHERE fragment and its parameters"""
+    clauses = []
+    params = []
+
+    for name in ("is_admin", "must_reset"):
+        flag = _parse_bool(args.get(name))
+        if flag is not None:
+            clauses.append(f"{name} = ?")
+            params.append(1 if flag else 0)
+
+    status = args.get("forgot_request_status")
+    if status is not None and not isinstance(status, str):
+        raise ValueError("forgot_request_status must be a string")
+    if status:
+        if status == "none":
+            clauses.append("forgot_request_status IS NULL")
+        else:
+            clauses.append("forgot_request_status = ?")
+            params.append(status)
+
+    ranges = (
+        ("created_after", "created_at", ">="),
+        ("created_before", "created_at", "<"),
+        ("last_login_after", "last_login_time", ">="),
+        ("last_login_before", "last_login_time", "<"),
+    )
+    for arg, column, op in ranges:
+        value = args.get(arg)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"{arg} must be a timestamp string")
+        if value:
+            clauses.append(f"{column} {op} ?")
+            params.append(value)
+
+    return clauses, params
+
+def _keyset_clause(sort, descending, last_value, last_slno):
+    """Rows strictly after (last_value, last_slno) in the requested order.
+
+    SQLite sorts NULLs first ascending and last descending, so nullable sort
+    columns need an explicit branch for the NULL block.
+    """
+    if sort == "slno":
+        return ("slno < ?" if descending else "slno > ?"), [last_slno]
+
+    if descending:
+        if last_value is None:
+            return f"({sort} IS NULL AND slno < ?)", [last_slno]
+        return (
+            f"({sort} < ? OR ({sort} = ? AND slno < ?) OR {sort} IS NULL)",
+            [last_value, last_value, last_slno],
+        )
+
+    if last_value is None:
+        return f"(({sort} IS NULL AND slno > ?) OR {sort} IS NOT NULL)", [last_slno]
+    return f"({sort} > ? OR ({sort} = ? AND slno > ?))", [last_value, last_value, last_slno]
+
 @admin_required
 def list_users():
+    """Return one page of users ordered by `sort`, continuing from `cursor`.
+
+    `since=<sync_cursor>` switches to delta mode: only users created or changed
+    after that cursor, in change order.
+    """
+    args = request.args
+    sort = args.get("sort", "slno")
+    order = args.get("order", "asc").lower()
+
+    if sort not in SORTABLE_COLUMNS:
+        return jsonify({"error": f"sort must be one of: {', '.join(SORTABLE_COLUMNS)}"}), 400
+    if order not in ("asc", "desc"):
+        return jsonify({"error": "order must be asc or desc"}), 400
+    for name, sorts in FILTER_SORTS.items():
+        if args.get(name) and sort not in sorts:
+            return jsonify({"error": f"{name} can only be combined with sort={' or '.join(sorts)}"}), 400
+
+    try:
+        limit = int(args.get("limit", USERS_PAGE_DEFAULT))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    limit = max(1, min(limit, USERS_PAGE_MAX))
+
+    since = args.get("since")
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({"error": "since must be an integer cursor"}), 400
+        return _list_user_changes(since, limit)
+
+    try:
+        clauses, params = build_user_filters(args)
+        cursor = args.get("cursor")
+        if cursor:
+            last_value, last_slno = _decode_cursor(cursor)
+            clause, clause_params = _keyset_clause(sort, order == "desc", last_value, last_slno)
+            clauses.append(clause)
+            params.extend(clause_params)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    direction = "DESC" if order == "desc" else "ASC"
+    order_by = f"slno {direction}" if sort == "slno" else f"{sort} {direction}, slno {direction}"
+
+    db = get_db()
+    version, updated_at = get_change_version(db, "users")
+
+    def build_payload():
+        # Fetch one extra row to learn whether another page exists
+        cur = db.execute(
+            f"SELECT {', '.join(USER_COLUMNS)} FROM users {where} ORDER BY {order_by} LIMIT ?",
+            params + [limit + 1],
+        )
+        rows = [dict(r) for r in cur.fetchall()]
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = None
+        if has_more:
+            last = rows[-1]
+            next_cursor = _encode_cursor([last[sort], last["slno"]])
+
+        return {
+            "users": rows,
+            "next_cursor": next_cursor,
+            "has_more": has_more,
+            "limit": limit,
+            # Start point for a later `since=` delta request
+            "sync_cursor": version,
+        }
+
+    etag = make_etag("users", version, request.query_string.decode())
+    return conditional_json(build_payload, etag, updated_at, rows_key="users")
+
+def _list_user_changes(since, limit):
+    """Rows inserted or updated after the `since` change cursor, oldest first"""
+    db = get_db()
+    version, updated_at = get_change_version(db, "users")
+
+    def build_payload():
+        cur = db.execute(
+            f"SELECT {', '.join(USER_COLUMNS)}, row_version FROM users "
+            "WHERE row_version > ? ORDER BY row_version LIMIT ?",
+            (since, limit + 1),
+        )
+        rows = [dict(r) for r in cur.fetchall()]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        # Without more rows the client is caught up to the version read above
+        cursor = rows[-1]["row_version"] if has_more else max(version, since)
+        return {"users": rows, "has_more": has_more, "sync_cursor": cursor}
+
+    etag = make_etag("users-since", version, since, limit)
+    return conditional_json(build_payload, etag, updated_at, rows_key="users")
+
+# ---------- User search ----------
+
+SEARCH_LIMIT_DEFAULT = int(os.getenv("SEARCH_LIMIT_DEFAULT", "20"))
+SEARCH_LIMIT_MAX = int(os.getenv("SEARCH_LIMIT_MAX", "100"))
+# Trigram hits fetched per stage before ranking; bounds the work per query
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "200"))
+# Minimum similarity (0-1) for a fuzzy hit to be returned
+SEARCH_FUZZY_MIN = float(os.getenv("SEARCH_FUZZY_MIN", "0.6"))
+
+def _search_columns(alias="users"):
+    return ", ".join(f"{alias}.{c}" for c in USER_COLUMNS)
+
+def _fts_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+def _search_prefix(db, q, limit):
+    """Usernames starting with q, case-insensitively, in index order.
+
+    NOCASE folds ASCII only, same as the index; U+10FFFF sorts after any
+    character that can follow the prefix, so the range stays on the index.
+    """
+    cur = db.execute(
+        f"SELECT {_search_columns()} FROM users "
+        "WHERE username >= ? COLLATE NOCASE AND username < ? COLLATE NOCASE "
+        "ORDER BY username COLLATE NOCASE LIMIT ?",
+        (q, q + "\U0010ffff", limit),
+    )
+    return [dict(r) for r in cur.fetchall()]
+
+def _search_trigram(db, match):
+    cur = db.execute(
+        f"SELECT {_search_columns('u')} FROM users_search "
+        "JOIN users u ON u.slno = users_search.rowid "
+        "WHERE users_search MATCH ? LIMIT ?",
+        (match, SEARCH_CANDIDATES),
+    )
+    return [dict(r) for r in cur.fetchall()]
+
+def _search_like(db, q):
+    # Full scan, only used when SQLite was built without FTS5
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    cur = db.execute(
+        f"SELECT {_search_columns()} FROM users WHERE username LIKE ? ESCAPE '\\' LIMIT ?",
+        (f"%{escaped}%", SEARCH_CANDIDATES),
+    )
+    return [dict(r) for r in cur.fetchall()]
+
+def search_users(db, q, limit):
+    """Ranked matches for q: prefix hits, then substrings, then near misses.
+
+    Substring and fuzzy stages need the trigram index and at least 3 (resp. 6)
+    characters. Fuzzy search splits q in two halves: a single typo leaves one
+    half intact, so OR-ing the halves as phrases finds the candidates, which
+    are then scored by similarity.
+    """
+    results = [dict(r, match="prefix") for r in _search_prefix(db, q, limit)]
+    seen = {r["slno"] for r in results}
+    folded = q.lower()
+
+    def add(rows, match, key):
+        fresh = [r for r in rows if r["slno"] not in seen]
+        for row in sorted(fresh, key=key)[:limit - len(results)]:
+            seen.add(row["slno"])
+            results.append(dict(row, match=match))
+
+    def substring_rank(row):
+        name = row["username"].lower()
+        return (name.find(folded), len(name), name)
+
+    if len(results) < limit and len(q) >= 3:
+        try:
+            rows = _search_trigram(db, _fts_phrase(q))
+        except sqlite3.OperationalError:
+            rows = _search_like(db, q)
+        add(rows, "substring", substring_rank)
+
+    if len(results) < limit and len(q) >= 6:
+        half = len(q) // 2
+        try:
+            rows = _search_trigram(db, f"{_fts_phrase(q[:half])} OR {_fts_phrase(q[half:])}")
+        except sqlite3.OperationalError:
+            rows = []
+        scored = []
+        for row in rows:
+            score = difflib.SequenceMatcher(None, folded, row["username"].lower()).ratio()
+            if score >= SEARCH_FUZZY_MIN:
+                scored.append(dict(row, score=round(score, 3)))
+        add(scored, "fuzzy", lambda r: (-r["score"], r["username"]))
+
+    return results
+
+@admin_required
+def admin_search_users():
+    """Find users by username: `q` (required) and optional `limit`"""
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"error": "q is required"}), 400
+    try:
+        limit = int(request.args.get("limit", SEARCH_LIMIT_DEFAULT))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    limit = max(1, min(limit, SEARCH_LIMIT_MAX))
+
     db = get_db()
-    cur = db.execute("""
-        SELECT slno, username, is_admin, must_reset, reset_requested, 
-               last_login_time, reset_password_time, created_at,
-               forgot_request_status, forgot_request_time, admin_note
-        FROM users 
-        ORDER BY slno
-    """)
-    rows = [dict(r) for r in cur.fetchall()]
-    return jsonify({"users": rows})
\ No newline at end of file
+    version, updated_at = get_change_version(db, "users")
+
+    def build_payload():
+        return {"users": search_users(db, q, limit), "query": q, "limit": limit}
+
+    etag = make_etag("users-search", version, q, limit)
+    return conditional_json(build_payload, etag, updated_at, rows_key="users")
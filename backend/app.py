@@ -1,52 +1,150 @@
 # app.py
-from flask import Flask, render_template
+import click
+from flask import Flask, render_template, jsonify
 from flask_cors import CORS  # Add this import
 from dotenv import load_dotenv
 import os
-from db_init import init_db, close_db
-from auth import login, me, change_password, change_username, forgot_request, auth_required,change_own_password
-from admin import admin_change_credentials, admin_create_user, admin_forgot_requests, admin_reset_user_password, list_users
+from db_init import init_db, close_db, get_pool, rebuild_dashboard_counters, PoolTimeout
+from hashing import HashingBusy
+import metrics
+import compression
+from auth import login, refresh, logout, me, change_password, change_username, forgot_request, auth_required,change_own_password
+from bulk_import import admin_import_users
+from bulk_export import admin_export_users
+from admin import admin_change_credentials, admin_create_user, admin_forgot_requests, admin_reset_user_password, admin_batch_reset_passwords, list_users, admin_db_pool_stats, admin_throttle_stats, admin_metrics, admin_events, admin_events_ticket, admin_stats, admin_search_users, admin_login_activity, admin_dormant_users
+from login_log import compact_login_events
+import spa
 
 load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecretdevkey")
 
-app = Flask(__name__)
-app.config["SECRET_KEY"] = SECRET_KEY
+def handle_pool_timeout(e):
+    response = jsonify({"error": "database busy, retry shortly"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
 
-# Enable CORS for all routes - Add this line
-CORS(app, origins=["http://localhost:4200"], supports_credentials=True)
+def handle_hashing_busy(e):
+    response = jsonify({"error": "server busy, retry shortly"})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
 
-# Register teardown
-app.teardown_appcontext(close_db)
+def register_routes(app):
+    # ---------- Authentication Routes ----------
+    app.add_url_rule("/api/login", view_func=login, methods=["POST"])
+    app.add_url_rule("/api/refresh", view_func=refresh, methods=["POST"])
+    app.add_url_rule("/api/logout", view_func=logout, methods=["POST"])
+    app.add_url_rule("/api/me", view_func=auth_required(me), methods=["GET"])
+    app.add_url_rule("/api/change_password", view_func=change_password, methods=["POST","PUT"])
+    app.add_url_rule("/api/change_username", view_func=auth_required(change_username), methods=["POST"])
+    app.add_url_rule("/api/forgot_request", view_func=forgot_request, methods=["POST"])
+    app.add_url_rule("/api/change_own_password", view_func=auth_required(change_own_password), methods=["PUT"])
 
-# ---------- Authentication Routes ----------
-app.add_url_rule("/api/login", view_func=login, methods=["POST"])
-app.add_url_rule("/api/me", view_func=me, methods=["GET"])
-app.add_url_rule("/api/change_password", view_func=change_password, methods=["POST","PUT"])
-app.add_url_rule("/api/change_username", view_func=change_username, methods=["POST"])
-app.add_url_rule("/api/forgot_request", view_func=forgot_request, methods=["POST"])
-app.add_url_rule("/api/change_own_password", view_func=change_own_password, methods=["PUT"])
+    # ---------- Admin Routes ----------
+    app.add_url_rule("/api/admin/change_credentials", view_func=admin_change_credentials, methods=["POST","PUT"])
+    app.add_url_rule("/api/admin/create_user", view_func=admin_create_user, methods=["POST"])
+    app.add_url_rule("/api/admin/forgot_requests", view_func=admin_forgot_requests, methods=["GET"])
+    app.add_url_rule("/api/admin/import_users", view_func=admin_import_users, methods=["POST"])
+    app.add_url_rule("/api/admin/export_users", view_func=admin_export_users, methods=["GET"])
+    app.add_url_rule("/api/admin/reset_user_password", view_func=admin_reset_user_password, methods=["POST"])
+    app.add_url_rule("/api/admin/batch_reset_passwords", view_func=admin_batch_reset_passwords, methods=["POST"])
+    app.add_url_rule("/api/users", view_func=list_users, methods=["GET"])
+    app.add_url_rule("/api/admin/users/search", view_func=admin_search_users, methods=["GET"])
+    app.add_url_rule("/api/admin/stats", view_func=admin_stats, methods=["GET"])
+    app.add_url_rule("/api/admin/login_activity", view_func=admin_login_activity, methods=["GET"])
+    app.add_url_rule("/api/admin/dormant_users", view_func=admin_dormant_users, methods=["GET"])
+    app.add_url_rule("/api/admin/db_pool", view_func=admin_db_pool_stats, methods=["GET"])
+    app.add_url_rule("/api/admin/throttle", view_func=admin_throttle_stats, methods=["GET"])
+    app.add_url_rule("/api/admin/metrics", view_func=admin_metrics, methods=["GET"])
+    app.add_url_rule("/api/admin/events", view_func=admin_events, methods=["GET"])
+    app.add_url_rule("/api/admin/events/ticket", view_func=admin_events_ticket, methods=["POST"])
 
-# ---------- Admin Routes ----------
-app.add_url_rule("/api/admin/change_credentials", view_func=admin_change_credentials, methods=["POST","PUT"])
-app.add_url_rule("/api/admin/create_user", view_func=admin_create_user, methods=["POST"])
-app.add_url_rule("/api/admin/forgot_requests", view_func=admin_forgot_requests, methods=["GET"])
-app.add_url_rule("/api/admin/reset_user_password", view_func=admin_reset_user_password, methods=["POST"])
-app.add_url_rule("/api/users", view_func=list_users, methods=["GET"])
+    # ---------- Frontend ----------
+    # The Angular production build when present, else the basic test UI
+    if spa.frontend_available():
+        spa.register_frontend(app)
+        return
 
-# ---------- Basic test UI routes (Very basic) ----------
-@app.route("/")
-def index():
-    return render_template("login.html")
+    # ---------- Basic test UI routes (Very basic) ----------
+    @app.route("/")
+    def index():
+        return render_template("login.html")
 
-@app.route("/user")
-def user_dashboard():
-    return render_template("user.html")
+    @app.route("/user")
+    def user_dashboard():
+        return render_template("user.html")
 
-@app.route("/admin")
-def admin_dashboard():
-    return render_template("admin.html")
+    @app.route("/admin")
+    def admin_dashboard():
+        return render_template("admin.html")
+
+def register_commands(app):
+    @app.cli.command("init-db")
+    def init_db_command():
+        """Create or migrate the database schema."""
+        init_db(app)
+        click.echo(f"Database initialized at: {os.getenv('DB_PATH', 'auf_admin.db')}")
+
+    @app.cli.command("rebuild-stats")
+    def rebuild_stats_command():
+        """Recompute the dashboard counters from the users table."""
+        # Creates the counter tables and triggers first on an unmigrated DB
+        init_db(app)
+        with get_pool().connection() as db:
+            rebuild_dashboard_counters(db)
+            db.commit()
+        click.echo("Dashboard counters rebuilt.")
+
+    @app.cli.command("compact-logins")
+    def compact_logins_command():
+        """Delete login events, hourly rollups and refresh tokens past their retention."""
+        init_db(app)
+        removed = compact_login_events()
+        click.echo(f"Removed {removed} rows.")
+
+    @app.cli.command("precompress")
+    def precompress_command():
+        """Write .gz/.br variants of the Angular build's text assets."""
+        if not spa.frontend_available():
+            raise click.ClickException(f"No Angular build at {spa.FRONTEND_DIST}; run 'ng build' first.")
+        written = spa.precompress()
+        click.echo(f"Wrote {written} compressed variants in {spa.FRONTEND_DIST}")
+
+    @app.cli.command("serve")
+    @click.option("--host", default=os.getenv("HOST", "127.0.0.1"), show_default=True)
+    @click.option("--port", default=int(os.getenv("PORT", "5000")), show_default=True, type=int)
+    @click.option("--workers", default=int(os.getenv("SERVE_WORKERS", "0")), type=int,
+                  help="Worker processes (default: one per CPU).")
+    def serve_command(host, port, workers):
+        """Run the API with prefork worker processes (no debugger or reloader)."""
+        from serve import serve
+        serve(app, host=host, port=port, workers=workers)
+
+def create_app():
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = SECRET_KEY
+
+    # Enable CORS for all routes - Add this line
+    CORS(app, origins=["http://localhost:4200"], supports_credentials=True)
+
+    # Register teardown
+    app.teardown_appcontext(close_db)
+
+    app.register_error_handler(PoolTimeout, handle_pool_timeout)
+    app.register_error_handler(HashingBusy, handle_hashing_busy)
+
+    # Per-route latency histograms and status counts
+    metrics.init_app(app)
+    # gzip/deflate for JSON bodies above COMPRESS_MIN_SIZE
+    compression.init_app(app)
+
+    register_routes(app)
+    register_commands(app)
+    return app
+
+app = create_app()
 
 # ---------- Run app ----------
 if __name__ == "__main__":
@@ -55,4 +153,4 @@ if __name__ == "__main__":
     DB = os.getenv("DB_PATH", "auf_admin.db")
     print(f"Database initialized at: {DB}")
     print("Default admin credentials: admin / admin123")
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -1,66 +1,173 @@
 # auth.py
 import datetime
+import hashlib
+import logging
+import secrets
 import jwt
 from functools import wraps
 from flask import request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
 import os
 from db_init import get_db
+from hashing import hash_password, verify_password, needs_rehash, record_rehash, HashingBusy
+from write_behind import REFRESH_TOKEN_INSERT, flush_refresh_tokens, record_last_login, record_refresh_token
+from login_log import record_login_attempt
+from cache import LRUCache
+from user_cache import get_user, get_user_by_username, invalidate_user
+import throttle
+from events import publish
+
+logger = logging.getLogger(__name__)
 
 SECRET_KEY = os.getenv("SECRET_KEY", "supersecretdevkey")  # change in production
 JWT_ALGORITHM = "HS256"
-JWT_EXP_SECONDS = 60 * 60 * 8  # 8 hours
+# Access tokens are short-lived; clients renew them through /api/refresh
+JWT_EXP_SECONDS = int(os.getenv("JWT_EXP_SECONDS", str(15 * 60)))
+REFRESH_TOKEN_SECONDS = int(os.getenv("REFRESH_TOKEN_SECONDS", str(60 * 60 * 24 * 14)))
+# Tickets only open a stream (e.g. EventSource, which cannot send headers);
+# they travel in the URL, so they expire quickly
+STREAM_TICKET_SECONDS = int(os.getenv("STREAM_TICKET_SECONDS", "30"))
+
+# Verified tokens are cached so repeat requests skip the HMAC check
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+_verified_tokens = LRUCache(TOKEN_CACHE_SIZE)
 
 def create_token(user):
     payload = {
         "user_id": user["slno"],
         "username": user["username"],
         "is_admin": user["is_admin"],
+        # Bumped on credential changes; tokens carrying an older value are rejected
+        "tv": user["token_version"],
         "exp": datetime.datetime.utcnow() + datetime.timedelta(seconds=JWT_EXP_SECONDS)
     }
     token = jwt.encode(payload, SECRET_KEY, algorithm=JWT_ALGORITHM)
     return token
 
+def create_stream_ticket(payload, purpose):
+    """Short-lived token accepted only where `purpose` is expected, for a
+    user whose access token has already been verified"""
+    ticket = {
+        "user_id": payload["user_id"],
+        "username": payload["username"],
+        "is_admin": payload["is_admin"],
+        "tv": payload.get("tv", 0),
+        "purpose": purpose,
+        "exp": datetime.datetime.utcnow() + datetime.timedelta(seconds=STREAM_TICKET_SECONDS)
+    }
+    return jwt.encode(ticket, SECRET_KEY, algorithm=JWT_ALGORITHM)
+
 def decode_token(token):
+    payload = _verified_tokens.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[JWT_ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         return None
     except Exception:
         return None
+    _verified_tokens.set(token, payload, expires_at=payload["exp"])
+    return payload
+
+def token_cache_stats():
+    return _verified_tokens.stats()
+
+def bump_token_version(db, user_id):
+    """Invalidate every token issued to a user so far (caller commits)"""
+    db.execute("UPDATE users SET token_version = token_version + 1 WHERE slno = ?", (user_id,))
+
+def _hash_refresh_token(token):
+    # The token is 256 random bits, so a plain digest is enough (no PBKDF2)
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def issue_refresh_token(db, user, family=None, write_behind=False):
+    """Store and return a new refresh token for `user` (caller commits).
+
+    Starts a new family unless `family` continues a rotation. With
+    `write_behind` the row may go through the login write-behind buffer.
+    Stale rows are pruned by the login log's compaction pass.
+    """
+    token = secrets.token_urlsafe(32)
+    now = datetime.datetime.utcnow()
+    values = (_hash_refresh_token(token), user["slno"], family or secrets.token_hex(8),
+              user["token_version"], now + datetime.timedelta(seconds=REFRESH_TOKEN_SECONDS))
+    if write_behind:
+        record_refresh_token(db, values)
+    else:
+        db.execute(REFRESH_TOKEN_INSERT, values)
+    return token
+
+def issue_tokens(db, user_id):
+    """Access and refresh token for a user whose token_version was just bumped
+    (and invalidated); commits the new refresh token"""
+    user = get_user(db, user_id)
+    refresh_token = issue_refresh_token(db, user)
+    db.commit()
+    return {
+        "access_token": create_token(user),
+        "refresh_token": refresh_token,
+        "expires_in": JWT_EXP_SECONDS,
+    }
+
+def other_admin_exists(db, user_id):
+    """Whether an admin other than user_id exists; an idx_users_is_admin seek, not a scan"""
+    return db.execute(
+        "SELECT 1 FROM users WHERE is_admin = 1 AND slno != ? LIMIT 1", (user_id,)
+    ).fetchone() is not None
+
+def token_version_current(payload, db=None):
+    user = get_user(db or get_db(), payload.get("user_id"))
+    return user is not None and user["token_version"] == payload.get("tv", 0)
+
+def authenticate(admin=False, ticket_purpose=None):
+    """Shared request authentication; returns an error response or None.
+
+    On success the token payload is attached as `request.user`.
+    With `ticket_purpose`, a stream ticket for that purpose (see
+    create_stream_ticket) is also accepted as ?ticket=. Tickets are never
+    accepted as access tokens, nor access tokens as tickets.
+    """
+    auth = request.headers.get("Authorization", "")
+    purpose = None
+    if auth.startswith("Bearer "):
+        token = auth.split(" ", 1)[1]
+    elif ticket_purpose and request.args.get("ticket"):
+        token, purpose = request.args["ticket"], ticket_purpose
+    else:
+        return jsonify({"error": "Missing token"}), 401
+    payload = decode_token(token)
+    if not payload or payload.get("purpose") != purpose or not token_version_current(payload):
+        return jsonify({"error": "Invalid or expired token"}), 401
+    if admin and not payload.get("is_admin"):
+        return jsonify({"error": "Admin privileges required"}), 403
+    # attach user info to request context
+    request.user = payload
+    return None
 
 def auth_required(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
-        auth = request.headers.get("Authorization", "")
-        if not auth.startswith("Bearer "):
-            return jsonify({"error": "Missing token"}), 401
-        token = auth.split(" ", 1)[1]
-        payload = decode_token(token)
-        if not payload:
-            return jsonify({"error": "Invalid or expired token"}), 401
-        # attach user info to request context
-        request.user = payload
+        error = authenticate()
+        if error:
+            return error
         return fn(*args, **kwargs)
     return wrapper
 
 def admin_required(fn):
     @wraps(fn)
     def wrapper(*args, **kwargs):
-        auth = request.headers.get("Authorization", "")
-        if not auth.startswith("Bearer "):
-            return jsonify({"error": "Missing token"}), 401
-        token = auth.split(" ", 1)[1]
-        payload = decode_token(token)
-        if not payload:
-            return jsonify({"error": "Invalid or expired token"}), 401
-        if not payload.get("is_admin"):
-            return jsonify({"error": "Admin privileges required"}), 403
-        request.user = payload
+        error = authenticate(admin=True)
+        if error:
+            return error
         return fn(*args, **kwargs)
     return wrapper
 
+def _too_many_requests(wait):
+    response = jsonify({"error": "too many attempts, try again later"})
+    response.status_code = 429
+    response.headers["Retry-After"] = throttle.retry_after_header(wait)
+    return response
+
 # ---------- Authentication Endpoints ----------
 
 def login():
@@ -71,35 +178,62 @@ def login():
     
     if not username or not password:
         return jsonify({"error": "username and password required"}), 400
+    if not isinstance(username, str) or not isinstance(password, str):
+        return jsonify({"error": "username and password must be strings"}), 400
+
+    # Shed brute-force traffic before touching the database or hashing
+    client_ip = request.remote_addr or "unknown"
+    wait = throttle.check(username, client_ip)
+    if wait:
+        record_login_attempt(None, username, False, "rate_limited", client_ip)
+        return _too_many_requests(wait)
 
     db = get_db()
     
-    # Select must_reset column to check if password change is required
-    cur = db.execute(
-        "SELECT slno, username, password, is_admin, must_reset FROM users WHERE username = ?", 
-        (username,)
-    )
-    row = cur.fetchone()
+    # Includes must_reset to check if password change is required
+    row = get_user_by_username(db, username)
     
+    if not row:
+        throttle.record_failure(username, client_ip)
+        record_login_attempt(None, username, False, "unknown_user", client_ip)
+        return jsonify({"error": "invalid credentials"}), 401
+
     if is_admin:
         if row["is_admin"] == 0:
+            throttle.record_failure(username, client_ip)
+            record_login_attempt(row["slno"], username, False, "not_admin", client_ip)
             return jsonify({"error": "Admin authorization"}), 401
 
-    if not row:
+    if not verify_password(row["password"], password):
+        throttle.record_failure(username, client_ip)
+        record_login_attempt(row["slno"], username, False, "bad_password", client_ip)
         return jsonify({"error": "invalid credentials"}), 401
 
-    if not check_password_hash(row["password"], password):
-        return jsonify({"error": "invalid credentials"}), 401
+    throttle.record_success(username)
+    record_login_attempt(row["slno"], username, True, None, client_ip)
 
     # Check if user must reset password (admin reset scenario)
     must_reset_password = row["must_reset"] if row["must_reset"] is not None else False
+
+    # Upgrade hashes made with older cost parameters while we have the plaintext
+    new_hash = None
+    if needs_rehash(row["password"]):
+        try:
+            new_hash = hash_password(password)
+        except HashingBusy:
+            pass  # try again on a later login rather than failing this one
     
-    # Update last login time
-    db.execute(
-        "UPDATE users SET last_login_time = ? WHERE slno = ?",
-        (datetime.datetime.now(), row["slno"])
-    )
+    if new_hash:
+        db.execute("UPDATE users SET password = ? WHERE slno = ?", (new_hash, row["slno"]))
+        record_rehash()
+
+    # Update last login time (possibly deferred to the write-behind buffer)
+    record_last_login(db, row["slno"], datetime.datetime.now())
+    refresh_token = issue_refresh_token(db, row, write_behind=True)
+    # A no-op unless something above was written synchronously
     db.commit()
+    if new_hash:
+        invalidate_user(row["slno"])
 
     user = {
         "slno": row["slno"], 
@@ -107,13 +241,87 @@ def login():
         "is_admin": row["is_admin"],
         "must_reset": must_reset_password  # Add this flag
     }
-    token = create_token(user)
+    token = create_token({**user, "token_version": row["token_version"]})
     return jsonify({
         "access_token": token, 
+        "refresh_token": refresh_token,
+        "expires_in": JWT_EXP_SECONDS,
         "user": user,
         "must_reset": must_reset_password  # Also include in response
     })
 
+def refresh():
+    """Trade a refresh token for a new access token and the next refresh token.
+
+    One indexed lookup and no password hashing. A token that was already
+    rotated is a replay, so its whole family is revoked and the holder has to
+    log in again.
+    """
+    data = request.json or {}
+    token = data.get("refresh_token")
+    if not token:
+        return jsonify({"error": "refresh_token required"}), 400
+
+    db = get_db()
+    now = datetime.datetime.utcnow()
+    token_hash = _hash_refresh_token(token)
+    lookup = (
+        "SELECT id, user_id, family, token_version, used_at, revoked, expires_at > ? AS live "
+        "FROM refresh_tokens WHERE token_hash = ?",
+        (now, token_hash),
+    )
+    row = db.execute(*lookup).fetchone()
+    if not row and flush_refresh_tokens(token_hash):
+        # It may still be in this process's write-behind buffer
+        row = db.execute(*lookup).fetchone()
+    if not row or row["revoked"] or not row["live"]:
+        return jsonify({"error": "invalid refresh token"}), 401
+
+    if row["used_at"] is not None:
+        db.execute("UPDATE refresh_tokens SET revoked = TRUE WHERE family = ?", (row["family"],))
+        db.commit()
+        logger.warning("refresh token reuse for user %s; family revoked", row["user_id"])
+        return jsonify({"error": "invalid refresh token"}), 401
+
+    user = get_user(db, row["user_id"])
+    # Credential changes bump token_version and so retire older refresh tokens
+    if not user or user["token_version"] != row["token_version"]:
+        return jsonify({"error": "invalid refresh token"}), 401
+
+    cur = db.execute(
+        "UPDATE refresh_tokens SET used_at = ? WHERE id = ? AND used_at IS NULL AND NOT revoked",
+        (now, row["id"]),
+    )
+    if cur.rowcount != 1:
+        # A concurrent refresh with the same token got there first
+        db.rollback()
+        return jsonify({"error": "invalid refresh token"}), 401
+    next_token = issue_refresh_token(db, user, row["family"])
+    db.commit()
+
+    return jsonify({
+        "access_token": create_token(user),
+        "refresh_token": next_token,
+        "expires_in": JWT_EXP_SECONDS,
+    })
+
+def logout():
+    """Revoke the refresh token's family; access tokens simply expire"""
+    data = request.json or {}
+    token = data.get("refresh_token")
+    if token:
+        token_hash = _hash_refresh_token(token)
+        # The token may still be in this process's write-behind buffer
+        flush_refresh_tokens(token_hash)
+        db = get_db()
+        db.execute(
+            "UPDATE refresh_tokens SET revoked = TRUE WHERE family = "
+            "(SELECT family FROM refresh_tokens WHERE token_hash = ?)",
+            (token_hash,),
+        )
+        db.commit()
+    return jsonify({"message": "logged out"})
+
 def me():
     return jsonify({"user": request.user})
 
@@ -125,24 +333,42 @@ def change_password():
     
     if not old or not new:
         return jsonify({"error": "old_password and new_password required"}), 400
+    if not isinstance(username, str) or not all(isinstance(p, str) for p in (old, new)):
+        return jsonify({"error": "username, old_password and new_password must be strings"}), 400
+
+    # Unauthenticated and checks a password, so it gets the login throttle
+    client_ip = request.remote_addr or "unknown"
+    wait = throttle.check(username, client_ip)
+    if wait:
+        return _too_many_requests(wait)
 
     db = get_db()
-    cur = db.execute("SELECT password, must_reset FROM users WHERE username = ?", (username,))
-    row = cur.fetchone()
+    row = get_user_by_username(db, username)
     
     if not row:
+        throttle.record_failure(username, client_ip)
         return jsonify({"error": "user not found"}), 404
 
-    if not check_password_hash(row["password"], old):
+    if not verify_password(row["password"], old):
+        throttle.record_failure(username, client_ip)
         return jsonify({"error": "old password incorrect"}), 401
 
+    throttle.record_success(username)
+
     # Update password and clear the must_reset flag
     db.execute(
         "UPDATE users SET password = ?, reset_password_time = ?, must_reset = FALSE WHERE username = ?",
-        (generate_password_hash(new), datetime.datetime.now(), username)
+        (hash_password(new), datetime.datetime.now(), username)
     )
+    bump_token_version(db, row["slno"])
     db.commit()
-    return jsonify({"message": "password updated", "success": True})
+    invalidate_user(row["slno"])
+    publish("user.credentials_changed", user_id=row["slno"])
+    return jsonify({
+        "message": "password updated",
+        "success": True,
+        **issue_tokens(db, row["slno"])
+    })
 
 def change_username():
     # Only allow admin to change username
@@ -160,20 +386,16 @@ def change_username():
     db = get_db()
     
     # Verify current password
-    cur = db.execute("SELECT password, is_admin FROM users WHERE slno = ?", (user_id,))
-    row = cur.fetchone()
+    row = get_user(db, user_id)
     if not row:
         return jsonify({"error": "user not found"}), 404
 
-    if not check_password_hash(row["password"], password):
+    if not verify_password(row["password"], password):
         return jsonify({"error": "password incorrect"}), 401
 
     # If user is admin, check if another admin exists (only one admin allowed)
-    if row["is_admin"]:
-        cur = db.execute("SELECT slno FROM users WHERE is_admin = 1 AND slno != ?", (user_id,))
-        other_admins = cur.fetchall()
-        if other_admins:
-            return jsonify({"error": "Cannot change admin username when other admins exist"}), 400
+    if row["is_admin"] and other_admin_exists(db, user_id):
+        return jsonify({"error": "Cannot change admin username when other admins exist"}), 400
 
     # Check if new username is already taken
     cur = db.execute("SELECT slno FROM users WHERE username = ? AND slno != ?", (new_username, user_id))
@@ -182,9 +404,15 @@ def change_username():
 
     # Update username
     db.execute("UPDATE users SET username = ? WHERE slno = ?", (new_username, user_id))
+    bump_token_version(db, user_id)  # old tokens carry the old username
     db.commit()
+    invalidate_user(user_id, row["username"])
+    publish("user.credentials_changed", user_id=user_id, username=new_username)
     
-    return jsonify({"message": "username updated successfully"})
+    return jsonify({
+        "message": "username updated successfully",
+        **issue_tokens(db, user_id)
+    })
 
 def change_own_password():
     # This endpoint uses the authenticated user from token
@@ -199,25 +427,28 @@ def change_own_password():
     username = request.user["username"]
     
     db = get_db()
-    cur = db.execute("SELECT password, must_reset FROM users WHERE slno = ?", (user_id,))
-    row = cur.fetchone()
+    row = get_user(db, user_id)
     
     if not row:
         return jsonify({"success": False, "message": "user not found"}), 404
 
-    if not check_password_hash(row["password"], old):
+    if not verify_password(row["password"], old):
         return jsonify({"success": False, "message": "old password incorrect"}), 401
 
     # Update password and clear the must_reset flag
     db.execute(
         "UPDATE users SET password = ?, reset_password_time = ?, must_reset = FALSE WHERE slno = ?",
-        (generate_password_hash(new), datetime.datetime.now(), user_id)
+        (hash_password(new), datetime.datetime.now(), user_id)
     )
+    bump_token_version(db, user_id)
     db.commit()
+    invalidate_user(user_id)
+    publish("user.credentials_changed", user_id=user_id)
     
     return jsonify({
         "success": True,
-        "message": "password updated successfully"
+        "message": "password updated successfully",
+        **issue_tokens(db, user_id)
     })
 
 def forgot_request():
@@ -225,10 +456,15 @@ def forgot_request():
     username = data.get("username")
     if not username:
         return jsonify({"error": "username required"}), 400
+    if not isinstance(username, str):
+        return jsonify({"error": "username must be a string"}), 400
+
+    wait = throttle.check(username, request.remote_addr or "unknown")
+    if wait:
+        return _too_many_requests(wait)
 
     db = get_db()
-    cur = db.execute("SELECT slno FROM users WHERE username = ?", (username,))
-    row = cur.fetchone()
+    row = get_user_by_username(db, username)
     if not row:
         # to avoid leaking info, we can return success even if user not found
         return jsonify({"message": "If the username exists, a request has been recorded."}), 200
@@ -240,4 +476,5 @@ def forgot_request():
         (datetime.datetime.now(), user_id)
     )
     db.commit()
+    publish("forgot_request.created", user_id=user_id, username=username)
     return jsonify({"message": "forgot password request created"}), 201
\ No newline at end of file
@@ -0,0 +1,325 @@
+# benchmark.py
+"""Load-test and benchmark suite for the auth/admin API.
+
+    python benchmark.py seed --db /tmp/bench.db --users 100000 --forgot-ratio 0.05
+    python benchmark.py run --db /tmp/bench.db --mode inprocess --concurrency 16 --out results.json
+    python benchmark.py run --db /tmp/bench.db --mode socket --baseline results.json --max-regression 0.2
+
+`run` exits with status 1 when --baseline is given and any endpoint's p95
+latency grew, or its throughput fell, by more than --max-regression.
+"""
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_PASSWORD = "bench-password"
+ENDPOINTS = ("login", "me", "users", "forgot_requests")
+
+# ---------- Seeding ----------
+
+def seed(db_path, users, forgot_ratio, hash_method, batch_size=10000):
+    """Create a fresh database with `users` accounts sharing one password hash"""
+    os.environ["DB_PATH"] = db_path
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    from werkzeug.security import generate_password_hash
+    from app import app
+    from db_init import init_db, get_pool
+
+    init_db(app)  # schema, indexes, triggers and the default admin
+    get_pool().close_all()
+
+    # Hashing every row would dominate seeding time; logins only need one hash
+    pwhash = generate_password_hash(BENCH_PASSWORD, method=hash_method)
+    rng = random.Random(42)
+    now = datetime.datetime.now()
+
+    conn = sqlite3.connect(db_path)
+    started = time.perf_counter()
+    for start in range(0, users, batch_size):
+        rows = []
+        for i in range(start, min(start + batch_size, users)):
+            created = now - datetime.timedelta(days=rng.randint(0, 730))
+            pending = rng.random() < forgot_ratio
+            rows.append((
+                f"user{i:07d}",
+                pwhash,
+                created,
+                now - datetime.timedelta(hours=rng.randint(0, 24 * 90)) if rng.random() < 0.8 else None,
+                "pending" if pending else None,
+                now - datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 7)) if pending else None,
+            ))
+        conn.executemany(
+            "INSERT INTO users (username, password, created_at, last_login_time, "
+            "forgot_request_status, forgot_request_time) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    print(f"seeded {users} users into {db_path} in {time.perf_counter() - started:.1f}s")
+
+# ---------- Clients ----------
+
+class InProcessClient:
+    """Drives the WSGI app directly through Flask's test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, token=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        response = self.client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+class SocketClient:
+    """Keep-alive HTTP client against a server on a local socket"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.conn = http.client.HTTPConnection(host, port, timeout=60)
+
+    def request(self, method, path, body=None, token=None):
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self.conn.request(method, path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            raise
+        data = response.read()
+        try:
+            parsed = json.loads(data) if data else None
+        except ValueError:
+            parsed = None
+        return response.status, parsed
+
+def _start_socket_server(app):
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no per-request access log
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+# ---------- Scenarios ----------
+
+def _scenario(endpoint, client, ctx, rng):
+    if endpoint == "login":
+        username = rng.choice(ctx["usernames"])
+        return client.request("POST", "/api/login", {"username": username, "password": BENCH_PASSWORD})
+    if endpoint == "me":
+        return client.request("GET", "/api/me", token=ctx["user_token"])
+    if endpoint == "users":
+        return client.request("GET", f"/api/users?limit={ctx['page_size']}", token=ctx["admin_token"])
+    if endpoint == "forgot_requests":
+        return client.request("GET", "/api/admin/forgot_requests", token=ctx["admin_token"])
+    raise ValueError(f"unknown endpoint {endpoint}")
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+def _bench_endpoint(endpoint, make_client, ctx, concurrency, requests, warmup):
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+    counter = iter(range(requests + warmup))
+    counter_lock = threading.Lock()
+
+    def worker(seed_value):
+        rng = random.Random(seed_value)
+        client = make_client()
+        local = []
+        local_errors = {}
+        while True:
+            with counter_lock:
+                n = next(counter, None)
+            if n is None:
+                break
+            started = time.perf_counter()
+            try:
+                status, _ = _scenario(endpoint, client, ctx, rng)
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            if n < warmup:
+                continue
+            if status != 200:
+                local_errors[str(status)] = local_errors.get(str(status), 0) + 1
+            local.append(elapsed)
+        with lock:
+            latencies.extend(local)
+            for key, value in local_errors.items():
+                errors[key] = errors.get(key, 0) + value
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / wall, 2) if wall else None,
+        "p50_ms": ms(_percentile(latencies, 50)),
+        "p95_ms": ms(_percentile(latencies, 95)),
+        "p99_ms": ms(_percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+    }
+
+def run(args):
+    os.environ["DB_PATH"] = args.db
+    if not args.keep_throttle:
+        # One client IP and a handful of users would trip the login limiter
+        for name in ("LOGIN_RATE_PER_USER", "LOGIN_RATE_PER_IP", "LOGIN_BURST_PER_USER", "LOGIN_BURST_PER_IP"):
+            os.environ[name] = "1000000000"
+
+    from app import app
+
+    conn = sqlite3.connect(args.db)
+    user_count = conn.execute("SELECT COUNT(*) FROM users WHERE is_admin = 0").fetchone()[0]
+    usernames = [r[0] for r in conn.execute(
+        "SELECT username FROM users WHERE is_admin = 0 ORDER BY RANDOM() LIMIT 1000"
+    )]
+    conn.close()
+    if not usernames:
+        sys.exit("database has no seeded users; run `benchmark.py seed` first")
+
+    server = None
+    if args.mode == "socket":
+        server = _start_socket_server(app)
+        make_client = lambda: SocketClient("127.0.0.1", server.server_port)
+    else:
+        make_client = lambda: InProcessClient(app)
+
+    setup = make_client()
+    status, body = setup.request("POST", "/api/login", {"username": args.admin_user, "password": args.admin_password})
+    if status != 200:
+        sys.exit(f"admin login failed ({status}); pass --admin-user/--admin-password")
+    admin_token = body["access_token"]
+    status, body = setup.request("POST", "/api/login", {"username": usernames[0], "password": BENCH_PASSWORD})
+    if status != 200:
+        sys.exit(f"user login failed ({status}); was the database made by `benchmark.py seed`?")
+    ctx = {
+        "usernames": usernames,
+        "admin_token": admin_token,
+        "user_token": body["access_token"],
+        "page_size": args.page_size,
+    }
+
+    results = {}
+    for endpoint in args.endpoints:
+        requests = args.login_requests if endpoint == "login" else args.requests
+        results[endpoint] = _bench_endpoint(endpoint, make_client, ctx, args.concurrency, requests, args.warmup)
+        r = results[endpoint]
+        print(f"{endpoint:>16}: {r['rps']:>9} req/s  p50 {r['p50_ms']}ms  p95 {r['p95_ms']}ms  "
+              f"p99 {r['p99_ms']}ms  errors {r['errors'] or 0}")
+
+    if server is not None:
+        server.shutdown()
+
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "mode": args.mode,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "login_requests": args.login_requests,
+            "page_size": args.page_size,
+            "user_count": user_count,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failures = compare(baseline, report, args.max_regression)
+        for line in failures:
+            print(f"REGRESSION {line}")
+        if failures:
+            sys.exit(1)
+
+def compare(baseline, current, max_regression):
+    """Describe every endpoint that regressed by more than `max_regression` (a fraction)"""
+    failures = []
+    for endpoint, now in current["results"].items():
+        before = baseline.get("results", {}).get(endpoint)
+        if not before:
+            continue
+        if before.get("p95_ms") and now.get("p95_ms") is not None:
+            if now["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+                failures.append(f"{endpoint}: p95 {before['p95_ms']}ms -> {now['p95_ms']}ms")
+        if before.get("rps") and now.get("rps") is not None:
+            if now["rps"] < before["rps"] * (1 - max_regression):
+                failures.append(f"{endpoint}: throughput {before['rps']} -> {now['rps']} req/s")
+    return failures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_seed = sub.add_parser("seed", help="create a database with synthetic users")
+    p_seed.add_argument("--db", required=True)
+    p_seed.add_argument("--users", type=int, default=1000)
+    p_seed.add_argument("--forgot-ratio", type=float, default=0.05)
+    p_seed.add_argument("--hash-method", default=os.getenv("HASH_METHOD", "pbkdf2:sha256:600000"))
+
+    p_run = sub.add_parser("run", help="drive the API and report latency percentiles")
+    p_run.add_argument("--db", required=True)
+    p_run.add_argument("--mode", choices=("inprocess", "socket"), default="inprocess")
+    p_run.add_argument("--concurrency", type=int, default=8)
+    p_run.add_argument("--requests", type=int, default=2000, help="measured requests per endpoint")
+    p_run.add_argument("--login-requests", type=int, default=200, help="measured logins (PBKDF2 is slow)")
+    p_run.add_argument("--warmup", type=int, default=20)
+    p_run.add_argument("--page-size", type=int, default=100)
+    p_run.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    p_run.add_argument("--admin-user", default="admin")
+    p_run.add_argument("--admin-password", default="admin123")
+    p_run.add_argument("--keep-throttle", action="store_true", help="leave the login limiter at its configured rates")
+    p_run.add_argument("--out", help="write results as JSON")
+    p_run.add_argument("--baseline", help="JSON results to compare against")
+    p_run.add_argument("--max-regression", type=float, default=0.2)
+
+    args = parser.parse_args(argv)
+    if args.command == "seed":
+        seed(args.db, args.users, args.forgot_ratio, args.hash_method)
+    else:
+        run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# bulk_export.py
+import csv
+import datetime
+import io
+import json
+import os
+import zlib
+from flask import request, jsonify, Response
+from auth import admin_required
+from admin import USER_COLUMNS, build_user_filters
+from db_init import get_pool
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+# Cells starting with these run as formulas when the CSV is opened in a spreadsheet
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def _parse_columns(value):
+    if not value:
+        return list(USER_COLUMNS)
+    columns = [c.strip() for c in value.split(",") if c.strip()]
+    unknown = [c for c in columns if c not in USER_COLUMNS]
+    if unknown or not columns:
+        raise ValueError(f"columns must be a comma-separated subset of: {', '.join(USER_COLUMNS)}")
+    return columns
+
+def _iter_chunks(columns, clauses, params):
+    """Yield lists of rows in slno order, one short read per chunk.
+
+    Each chunk borrows a pooled connection only for its own SELECT, so a slow
+    download holds neither a connection nor a read transaction in between.
+    The export is therefore not a single snapshot: rows changed while it runs
+    appear as they were when their chunk was read.
+    """
+    select = ", ".join(dict.fromkeys(["slno"] + columns))
+    last_slno = 0
+    while True:
+        where = " AND ".join(clauses + ["slno > ?"])
+        with get_pool().connection() as db:
+            rows = db.execute(
+                f"SELECT {select} FROM users WHERE {where} ORDER BY slno LIMIT ?",
+                params + [last_slno, EXPORT_CHUNK_SIZE],
+            ).fetchall()
+        if not rows:
+            return
+        last_slno = rows[-1]["slno"]
+        yield rows
+        if len(rows) < EXPORT_CHUNK_SIZE:
+            return
+
+def _csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def _csv_lines(columns, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows([_csv_cell(row[c]) for c in columns] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def _ndjson_lines(columns, chunks):
+    for rows in chunks:
+        yield "".join(json.dumps({c: row[c] for c in columns}) + "\n" for row in rows)
+
+def _gzipped(parts):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for part in parts:
+        data = compressor.compress(part.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@admin_required
+def admin_export_users():
+    """Stream every user matching the /api/users filters as CSV or NDJSON.
+
+    `format` is csv (default) or ndjson, `columns` a comma-separated subset of
+    the user columns, and `gzip=1` returns a .gz file. Rows are read in slno
+    chunks of EXPORT_CHUNK_SIZE and written out as they arrive, so memory use
+    does not grow with the table.
+    """
+    args = request.args
+    fmt = args.get("format", "csv").lower()
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    compress = args.get("gzip", "").lower() in ("1", "true", "yes")
+
+    try:
+        columns = _parse_columns(args.get("columns"))
+        clauses, params = build_user_filters(args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    chunks = _iter_chunks(columns, clauses, params)
+    if fmt == "csv":
+        body, mimetype, extension = _csv_lines(columns, chunks), "text/csv", "csv"
+    else:
+        body, mimetype, extension = _ndjson_lines(columns, chunks), "application/x-ndjson", "ndjson"
+
+    filename = f"users-{datetime.datetime.now():%Y%m%d-%H%M%S}.{extension}"
+    if compress:
+        body, mimetype, filename = _gzipped(body), "application/gzip", filename + ".gz"
+
+    response = Response(body, mimetype=mimetype)
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    response.headers["Cache-Control"] = "no-store"
+    return response
@@ -0,0 +1,201 @@
+# bulk_import.py
+import csv
+import io
+import json
+import os
+import sqlite3
+from flask import request, jsonify, Response, stream_with_context
+from auth import admin_required
+from db_init import get_db
+from hashing import HashingBusy, hash_passwords
+from events import publish
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+USERNAME_MAX_LENGTH = int(os.getenv("USERNAME_MAX_LENGTH", "150"))
+
+def _detect_format(upload_name):
+    fmt = request.args.get("format")
+    if fmt:
+        return fmt.lower()
+    name = (upload_name or "").lower()
+    if name.endswith(".csv") or request.mimetype == "text/csv":
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")) or request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    return None
+
+def _iter_csv(stream):
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    for record in reader:
+        yield reader.line_num, record
+
+def _iter_ndjson(stream):
+    for line_no, line in enumerate(io.TextIOWrapper(stream, encoding="utf-8"), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_no, None
+            continue
+        yield line_no, record if isinstance(record, dict) else None
+
+def _validate(record):
+    if record is None:
+        return None, None, "malformed record"
+    username = record.get("username") or ""
+    password = record.get("password") or ""
+    if not isinstance(username, str) or not isinstance(password, str):
+        return (username if isinstance(username, str) else None), None, "username and password must be strings"
+    username = username.strip()
+    if not username or not password:
+        return username, None, "username and password required"
+    if len(username) > USERNAME_MAX_LENGTH:
+        return username, None, f"username longer than {USERNAME_MAX_LENGTH} characters"
+    return username, password, None
+
+class _ImportStopped(Exception):
+    """A batch could not be written; rows after it are not read"""
+
+def _existing_usernames(db, usernames):
+    if not usernames:
+        return set()
+    placeholders = ",".join("?" * len(usernames))
+    cur = db.execute(f"SELECT username FROM users WHERE username IN ({placeholders})", list(usernames))
+    return {r["username"] for r in cur.fetchall()}
+
+def _import_batch(db, batch):
+    """Create one batch of users; returns a result dict per input row.
+
+    Hashing happens outside any transaction; the write transaction only
+    re-checks for names created meanwhile and runs one executemany.
+    """
+    results = []
+    candidates = []
+    taken = _existing_usernames(db, {r[1] for r in batch if r[3] is None})
+    for line_no, username, password, problem in batch:
+        if problem:
+            status, error = problem
+            result = {"line": line_no, "username": username, "status": status}
+            if error:
+                result["error"] = error
+            results.append(result)
+        elif username in taken:
+            results.append({"line": line_no, "username": username, "status": "duplicate"})
+        else:
+            candidates.append((line_no, username, password))
+            results.append(None)  # filled in after the insert
+
+    if candidates:
+        hashes = hash_passwords([c[2] for c in candidates])
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            raced = _existing_usernames(db, {c[1] for c in candidates})
+            rows = [
+                (username, pwhash, False, True)
+                for (line_no, username, _), pwhash in zip(candidates, hashes)
+                if username not in raced
+            ]
+            db.executemany(
+                "INSERT INTO users (username, password, is_admin, must_reset) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        pending = iter(candidates)
+        for i, result in enumerate(results):
+            if result is None:
+                line_no, username, _ = next(pending)
+                status = "duplicate" if username in raced else "created"
+                results[i] = {"line": line_no, "username": username, "status": status}
+
+    return results
+
+def _failed_batch(batch, error):
+    """Results for a batch whose write failed: problems as found, the rest failed"""
+    results = []
+    for line_no, username, _, problem in batch:
+        status, row_error = problem or ("failed", error)
+        result = {"line": line_no, "username": username, "status": status}
+        if row_error:
+            result["error"] = row_error
+        results.append(result)
+    return results
+
+@admin_required
+def admin_import_users():
+    """Create users from a CSV or NDJSON upload with `username` and `password` fields.
+
+    The body may be the raw file or a multipart form with a `file` field. Input
+    is read and committed in batches of IMPORT_BATCH_SIZE, and the response is
+    streamed back as NDJSON: one result per input row (created / duplicate /
+    invalid / failed) followed by a final `{"summary": {...}}` line, which
+    carries an `error` if the import stopped early.
+    """
+    upload = request.files.get("file")
+    stream = upload.stream if upload else request.stream
+    fmt = _detect_format(upload.filename if upload else None)
+
+    if fmt == "csv":
+        records = _iter_csv(stream)
+    elif fmt == "ndjson":
+        records = _iter_ndjson(stream)
+    else:
+        return jsonify({"error": "format must be csv or ndjson (use ?format= or a matching Content-Type)"}), 400
+
+    def generate():
+        db = get_db()
+        summary = {"created": 0, "duplicate": 0, "invalid": 0, "failed": 0}
+        seen = set()
+        batch = []
+
+        def flush():
+            # Earlier batches are committed and streamed already, so a failure
+            # here is reported in-band rather than breaking the response
+            stopped = None
+            try:
+                results = _import_batch(db, batch)
+            except HashingBusy:
+                stopped = "password hashing is busy"
+            except sqlite3.Error as e:
+                stopped = f"database error: {e}"
+            if stopped:
+                results = _failed_batch(batch, stopped)
+            for result in results:
+                summary[result["status"]] += 1
+                yield json.dumps(result) + "\n"
+            batch.clear()
+            if stopped:
+                raise _ImportStopped(stopped)
+
+        try:
+            for line_no, record in records:
+                username, password, error = _validate(record)
+                if error:
+                    problem = ("invalid", error)
+                elif username in seen:
+                    problem = ("duplicate", "repeated in upload")
+                else:
+                    problem = None
+                    seen.add(username)
+                batch.append((line_no, username, password, problem))
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    yield from flush()
+            if batch:
+                yield from flush()
+        except _ImportStopped as e:
+            summary["error"] = f"{e}; import stopped"
+        except UnicodeDecodeError:
+            summary["error"] = "upload is not valid UTF-8; import stopped"
+        except csv.Error as e:
+            summary["error"] = f"CSV parse error: {e}; import stopped"
+
+        if summary["created"]:
+            publish("users.imported", created=summary["created"])
+        yield json.dumps({"summary": summary}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
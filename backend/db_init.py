@@ -1,21 +1,483 @@
 # db_init.py
+import datetime
+import logging
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from werkzeug.security import generate_password_hash
+from hashing import HASH_METHOD, HASH_SALT_LENGTH
 from flask import g
+from metrics import connection_factory
 import os
 
+logger = logging.getLogger(__name__)
+
 DB = os.getenv("DB_PATH", "auf_admin.db")
 
+# ---------- Connection pool ----------
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# Idle connections older than this are pinged before being handed out again
+DB_POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", "30"))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+
+# Applied in this order to every new connection. WAL lets readers run while a
+# writer commits; NORMAL sync is durable across app crashes in WAL mode.
+DB_PRAGMAS = {
+    "journal_mode": os.getenv("DB_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("DB_SYNCHRONOUS", "NORMAL"),
+    "cache_size": os.getenv("DB_CACHE_SIZE", "-16000"),  # negative = KiB
+    "mmap_size": os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)),
+    "busy_timeout": os.getenv("DB_BUSY_TIMEOUT", "5000"),  # ms
+    "temp_store": os.getenv("DB_TEMP_STORE", "MEMORY"),
+}
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection frees up within DB_POOL_TIMEOUT"""
+
+class ConnectionPool:
+    """Bounded pool of tuned SQLite connections.
+
+    A thread gets back the connection it used last when that one is idle, so
+    its page and statement caches stay warm. Connections that sat idle for a
+    while are health-checked before reuse and replaced if broken.
+    """
+
+    def __init__(self, path, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 pragmas=None, statement_cache=DB_STATEMENT_CACHE):
+        self.path = path
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.pragmas = DB_PRAGMAS if pragmas is None else pragmas
+        self.statement_cache = statement_cache
+        self._cond = threading.Condition()
+        self._idle = []  # (connection, released_at), most recent last
+        self._size = 0
+        self._local = threading.local()
+        self._counters = {
+            "created": 0,
+            "acquired": 0,
+            "thread_reuse": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,  # the pool serializes access
+            cached_statements=self.statement_cache,
+            factory=connection_factory(),  # per-statement timing for /api/admin/metrics
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            if value not in (None, ""):
+                conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _take_idle(self):
+        preferred = getattr(self._local, "conn", None)
+        for i, (conn, released_at) in enumerate(self._idle):
+            if conn is preferred:
+                self._counters["thread_reuse"] += 1
+                return self._idle.pop(i)
+        return self._idle.pop()
+
+    def _healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    raise PoolTimeout(f"no database connection available after {self.timeout}s")
+                self._counters["waits"] += 1
+                self._cond.wait(remaining)
+
+            if self._idle:
+                conn, released_at = self._take_idle()
+            else:
+                conn, released_at = None, None
+                self._size += 1  # reserve the slot before connecting outside the lock
+            self._counters["acquired"] += 1
+
+        if conn is not None and time.monotonic() - released_at > DB_POOL_CHECK_AFTER:
+            if not self._healthy(conn):
+                with self._cond:
+                    self._counters["health_check_failures"] += 1
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+                conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._counters["created"] += 1
+
+        self._local.conn = conn
+        return conn
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()  # never hand out a connection holding locks
+        except sqlite3.Error:
+            conn.close()
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection outside of a request context"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            conn.close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                **self._counters,
+            }
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB)
+    return _pool
+
+def pool_stats():
+    return get_pool().stats()
+
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(DB)
-        g.db.row_factory = sqlite3.Row
+        g.db = get_pool().acquire()
     return g.db
 
 def close_db(e=None):
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        get_pool().release(db)
+
+def add_column_if_missing(db, table, column, definition):
+    columns = {r[1] for r in db.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def init_change_tracking(db):
+    """Monotonic change counters used for ETags and `since=` delta sync.
+
+    `sync_state` holds one counter per feed. Every insert or update of a user
+    bumps the `users` counter and stamps the row with it in `row_version`;
+    changes to the forgot-request columns also bump `forgot_requests`, so that
+    feed's ETag survives unrelated writes such as logins. `accounts` moves only
+    when a user is created or their username, password, flags or token
+    version change; the admin event stream watches it instead of `users`.
+    """
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    db.execute("INSERT OR IGNORE INTO sync_state (name) VALUES ('users'), ('forgot_requests'), ('accounts')")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_users_row_version ON users (row_version)")
+
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_version_insert AFTER INSERT ON users
+        BEGIN
+            UPDATE sync_state SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+             WHERE name = 'users';
+            UPDATE users SET row_version = (SELECT version FROM sync_state WHERE name = 'users')
+             WHERE slno = NEW.slno;
+        END
+    """)
+    # The WHEN guard skips the trigger's own row_version stamp
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_version_update AFTER UPDATE ON users
+        WHEN NEW.row_version = OLD.row_version
+        BEGIN
+            UPDATE sync_state SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+             WHERE name = 'users';
+            UPDATE users SET row_version = (SELECT version FROM sync_state WHERE name = 'users')
+             WHERE slno = NEW.slno;
+        END
+    """)
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_forgot_version AFTER UPDATE ON users
+        WHEN NEW.forgot_request_status IS NOT OLD.forgot_request_status
+          OR NEW.forgot_request_time IS NOT OLD.forgot_request_time
+          OR (NEW.forgot_request_status IS NOT NULL AND NEW.username IS NOT OLD.username)
+        BEGIN
+            UPDATE sync_state SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+             WHERE name = 'forgot_requests';
+        END
+    """)
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_accounts_insert AFTER INSERT ON users
+        BEGIN
+            UPDATE sync_state SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+             WHERE name = 'accounts';
+        END
+    """)
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_accounts_update
+        AFTER UPDATE OF username, password, is_admin, must_reset, token_version ON users
+        WHEN NEW.username IS NOT OLD.username OR NEW.password IS NOT OLD.password
+          OR NEW.is_admin IS NOT OLD.is_admin OR NEW.must_reset IS NOT OLD.must_reset
+          OR NEW.token_version IS NOT OLD.token_version
+        BEGIN
+            UPDATE sync_state SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+             WHERE name = 'accounts';
+        END
+    """)
+
+def init_user_search(db):
+    """Indexes behind /api/admin/users/search.
+
+    A NOCASE index serves case-insensitive prefix lookups. `users_search` is
+    an FTS5 trigram index over usernames for substring and fuzzy matching; it
+    stores no copy of the text (content='users') and triggers keep it in step
+    with inserts, deletes and renames. SQLite builds without FTS5 fall back
+    to a LIKE scan in the endpoint.
+    """
+    db.execute("CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE)")
+
+    exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_search'"
+    ).fetchone()
+    if exists:
+        return
+    try:
+        db.execute("""
+            CREATE VIRTUAL TABLE users_search USING fts5(
+                username, content='users', content_rowid='slno', tokenize='trigram'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        logger.warning("username search index unavailable (%s); using LIKE scans", e)
+        return
+
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_search_insert AFTER INSERT ON users
+        BEGIN
+            INSERT INTO users_search (rowid, username) VALUES (NEW.slno, NEW.username);
+        END
+    """)
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_search_delete AFTER DELETE ON users
+        BEGIN
+            INSERT INTO users_search (users_search, rowid, username) VALUES ('delete', OLD.slno, OLD.username);
+        END
+    """)
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_search_update AFTER UPDATE OF username ON users
+        BEGIN
+            INSERT INTO users_search (users_search, rowid, username) VALUES ('delete', OLD.slno, OLD.username);
+            INSERT INTO users_search (rowid, username) VALUES (NEW.slno, NEW.username);
+        END
+    """)
+    # Index the users that existed before the table did
+    db.execute("INSERT INTO users_search (users_search) VALUES ('rebuild')")
+
+def init_refresh_tokens(db):
+    """Rotating refresh tokens, stored as SHA-256 hashes.
+
+    Each login starts a `family`; every refresh marks its token used and adds
+    the next one to the family, so presenting a used token again (a stolen
+    copy being replayed) can revoke the whole family. `token_version` is the
+    user's value at issue time; credential changes bump it, which retires
+    every refresh token issued before.
+    """
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS refresh_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            token_hash TEXT UNIQUE NOT NULL,
+            user_id INTEGER NOT NULL REFERENCES users (slno),
+            family TEXT NOT NULL,
+            token_version INTEGER NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            expires_at DATETIME NOT NULL,
+            used_at DATETIME DEFAULT NULL,
+            revoked BOOLEAN DEFAULT FALSE NOT NULL
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_refresh_tokens_family ON refresh_tokens (family)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_refresh_tokens_user ON refresh_tokens (user_id, expires_at)")
+
+# Rotated refresh tokens are kept this long so a replayed copy is still
+# recognized (and its family revoked); after that they are pruned
+REFRESH_REUSE_WINDOW_SECONDS = int(os.getenv("REFRESH_REUSE_WINDOW_SECONDS", str(60 * 60 * 24)))
+
+def prune_refresh_tokens(conn, batch_size=5000, now=None):
+    """Delete expired and revoked refresh tokens, and rotated ones older than
+    REFRESH_REUSE_WINDOW_SECONDS, a batch per transaction"""
+    now = now or datetime.datetime.utcnow()
+    used_before = now - datetime.timedelta(seconds=REFRESH_REUSE_WINDOW_SECONDS)
+    removed = 0
+    while True:
+        cur = conn.execute(
+            "DELETE FROM refresh_tokens WHERE id IN (SELECT id FROM refresh_tokens "
+            "WHERE expires_at <= ? OR revoked OR used_at < ? LIMIT ?)",
+            (now, used_before, batch_size),
+        )
+        conn.commit()
+        removed += cur.rowcount
+        if cur.rowcount < batch_size:
+            return removed
+
+def init_login_events(db):
+    """Append-only login log plus the rollups the dashboard reads.
+
+    login_log.py writes events in batches and adds each batch's counts to the
+    hourly and daily rollups in the same transaction. Raw events and hourly
+    rows are compacted away after their retention period; daily rows are
+    kept. Buckets use server local time, like the users timestamps.
+    """
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS login_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at DATETIME NOT NULL,
+            user_id INTEGER,
+            username TEXT,
+            success BOOLEAN NOT NULL,
+            reason TEXT,
+            ip TEXT
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_login_events_created_at ON login_events (created_at)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_login_events_user ON login_events (user_id, created_at)")
+    for table, key in (("login_stats_hourly", "hour"), ("login_stats_daily", "day")):
+        db.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key} TEXT PRIMARY KEY,
+                successes INTEGER NOT NULL DEFAULT 0,
+                failures INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+
+COUNTER_NAMES = ("total_users", "admin_users", "pending_resets", "must_reset_users")
+
+def _counter_deltas(sign, ref):
+    """CASE expression adding (sign=+) or removing (sign=-) row `ref` from each counter"""
+    return f"""CASE name
+            WHEN 'total_users' THEN {sign}1
+            WHEN 'admin_users' THEN {sign}(COALESCE({ref}.is_admin, 0) != 0)
+            WHEN 'pending_resets' THEN {sign}({ref}.forgot_request_status IS 'pending')
+            WHEN 'must_reset_users' THEN {sign}(COALESCE({ref}.must_reset, 0) != 0)
+            ELSE 0 END"""
+
+def init_dashboard_counters(db):
+    """Summary numbers for /api/admin/stats, kept current by triggers.
+
+    `dashboard_counters` holds one row per count, so reading the stats
+    touches a handful of rows whatever the table size. Every write path,
+    including bulk import, is covered because the triggers live in SQLite.
+    Login counts come from the login_stats_hourly rollup.
+    """
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS dashboard_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+    db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_users_counters_insert AFTER INSERT ON users
+        BEGIN
+            UPDATE dashboard_counters SET value = value + {_counter_deltas("+", "NEW")};
+        END
+    """)
+    db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_users_counters_delete AFTER DELETE ON users
+        BEGIN
+            UPDATE dashboard_counters SET value = value + {_counter_deltas("-", "OLD")};
+        END
+    """)
+    db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_users_counters_update
+        AFTER UPDATE OF is_admin, must_reset, forgot_request_status ON users
+        BEGIN
+            UPDATE dashboard_counters SET value = value
+                + {_counter_deltas("+", "NEW")}
+                + {_counter_deltas("-", "OLD")};
+        END
+    """)
+    # Superseded by the login event rollups
+    db.execute("DROP TRIGGER IF EXISTS trg_users_login_hourly")
+    db.execute("DROP TABLE IF EXISTS login_hourly")
+
+    count = db.execute("SELECT COUNT(*) FROM dashboard_counters").fetchone()[0]
+    if count != len(COUNTER_NAMES):
+        rebuild_dashboard_counters(db)
+
+def rebuild_dashboard_counters(db):
+    """Recompute the counters from the users table (caller commits)"""
+    db.execute("DELETE FROM dashboard_counters")
+    db.execute("""
+        INSERT INTO dashboard_counters (name, value)
+        SELECT 'total_users', COUNT(*) FROM users
+        UNION ALL SELECT 'admin_users', COUNT(*) FROM users WHERE COALESCE(is_admin, 0) != 0
+        UNION ALL SELECT 'pending_resets', COUNT(*) FROM users WHERE forgot_request_status = 'pending'
+        UNION ALL SELECT 'must_reset_users', COUNT(*) FROM users WHERE COALESCE(must_reset, 0) != 0
+    """)
+
+def get_dashboard_stats(db):
+    stats = {r["name"]: r["value"] for r in db.execute("SELECT name, value FROM dashboard_counters")}
+    # last_login_time is written in server local time; the current partial
+    # hour plus the previous 24 whole hours are summed
+    row = db.execute("""
+        SELECT COALESCE(SUM(successes), 0) FROM login_stats_hourly
+        WHERE hour >= strftime('%Y-%m-%d %H', 'now', 'localtime', '-24 hours')
+    """).fetchone()
+    stats["logins_24h"] = row[0]
+    return stats
+
+def get_change_version(db, name="users"):
+    """Return (version, updated_at) for a change feed in sync_state"""
+    row = db.execute("SELECT version, updated_at FROM sync_state WHERE name = ?", (name,)).fetchone()
+    return row["version"], row["updated_at"]
 
 def init_db(app):
     """Initialize the database with a single table"""
@@ -36,9 +498,37 @@ def init_db(app):
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 forgot_request_status TEXT DEFAULT NULL,
                 forgot_request_time DATETIME DEFAULT NULL,
-                admin_note TEXT DEFAULT NULL
+                admin_note TEXT DEFAULT NULL,
+                row_version INTEGER DEFAULT 0 NOT NULL,
+                token_version INTEGER DEFAULT 0 NOT NULL
             )
         """)
+
+        # Databases created before these columns existed get them added
+        add_column_if_missing(db, "users", "row_version", "INTEGER DEFAULT 0 NOT NULL")
+        add_column_if_missing(db, "users", "token_version", "INTEGER DEFAULT 0 NOT NULL")
+
+        # Indexes backing the keyset pagination and filters of /api/users
+        db.execute("CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_users_last_login_time ON users (last_login_time)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_users_forgot_request_time ON users (forgot_request_time)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_users_must_reset ON users (must_reset)")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_users_is_admin ON users (is_admin)")
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_users_forgot_status "
+            "ON users (forgot_request_status, forgot_request_time)"
+        )
+        # Flag filter + sort pairs, so a filtered page is read in order rather
+        # than sorted in full (admin.FILTER_SORTS lists what these cover)
+        for flag in ("is_admin", "must_reset"):
+            for column in ("username", "created_at", "last_login_time", "forgot_request_time"):
+                db.execute(f"CREATE INDEX IF NOT EXISTS idx_users_{flag}_{column} ON users ({flag}, {column})")
+
+        init_change_tracking(db)
+        init_login_events(db)
+        init_dashboard_counters(db)
+        init_user_search(db)
+        init_refresh_tokens(db)
         
         # Check if admin user exists, if not create one
         cur = db.execute("SELECT slno FROM users WHERE is_admin = 1")
@@ -48,7 +538,9 @@ def init_db(app):
             # Create default admin user
             default_admin_username = "admin"
             default_admin_password = "admin123"  # Change this in production!
-            hashed_password = generate_password_hash(default_admin_password)
+            hashed_password = generate_password_hash(
+                default_admin_password, method=HASH_METHOD, salt_length=HASH_SALT_LENGTH
+            )
             
             db.execute(
                 "INSERT INTO users (username, password, is_admin) VALUES (?, ?, ?)",
@@ -0,0 +1,190 @@
+# events.py
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from db_init import get_pool
+
+logger = logging.getLogger(__name__)
+
+EVENTS_BUFFER = int(os.getenv("EVENTS_BUFFER", "1000"))
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+# How often each process checks sync_state for writes made by other workers
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "2"))
+# sync_state counters the watcher follows; `users` also moves on every login
+SYNC_FEEDS = ("accounts", "forgot_requests")
+# Counters each detailed event moves, by event type or its prefix
+EVENT_FEEDS = {
+    "user": ("accounts",),
+    "users": ("accounts",),
+    "forgot_request.created": ("forgot_requests",),
+    "forgot_request.resolved": ("forgot_requests", "accounts"),  # resolved by a reset
+}
+
+def _read_versions():
+    with get_pool().connection() as conn:
+        rows = conn.execute(
+            f"SELECT name, version FROM sync_state WHERE name IN ({', '.join('?' * len(SYNC_FEEDS))})",
+            SYNC_FEEDS,
+        ).fetchall()
+    return {row["name"]: row["version"] for row in rows}
+
+class EventBus:
+    """In-process pub/sub with a replay buffer for Last-Event-ID resume.
+
+    Event ids are "<boot>-<seq>": a client resuming with an id from another
+    process or an older boot, or one that fell out of the buffer, gets a
+    `reset` event telling it to refetch instead of silently missing events.
+
+    With several worker processes each has its own bus and only sees the
+    detailed events published by requests it handled itself. To cover the
+    rest, a watcher thread polls the sync_state change counters while anyone
+    is subscribed and publishes a `sync` event naming the feeds that moved.
+    Changes already announced by a detailed event from this process are
+    not repeated.
+    """
+
+    def __init__(self, maxlen=EVENTS_BUFFER):
+        self.boot = uuid.uuid4().hex[:8]
+        self._events = deque(maxlen=maxlen)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self.subscribers = 0
+        self.published = 0
+        self._watcher = None
+        self._watcher_pid = None
+        self._closed = False
+        self._announced = {}  # feed -> counter value covered by a local event
+
+    def publish(self, event_type, data, feeds=()):
+        if feeds and self.subscribers:
+            try:
+                versions = _read_versions()
+            except Exception:
+                logger.exception("failed to read sync_state versions")
+                versions = {}
+            with self._cond:
+                for feed in feeds:
+                    if feed in versions:
+                        self._announced[feed] = max(versions[feed], self._announced.get(feed, 0))
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, event_type, json.dumps(data)))
+            self.published += 1
+            self._cond.notify_all()
+
+    def _ensure_watcher(self):
+        # Started lazily so each forked worker runs its own watcher
+        if self._watcher_pid == os.getpid() and self._watcher.is_alive():
+            return
+        self._watcher = threading.Thread(target=self._watch, name="events-watcher", daemon=True)
+        self._watcher_pid = os.getpid()
+        self._watcher.start()
+
+    def _watch(self):
+        seen = None
+        while True:
+            time.sleep(EVENTS_POLL_INTERVAL)
+            if not self.subscribers:
+                seen = None  # nobody to tell; start from fresh counters next time
+                continue
+            try:
+                versions = _read_versions()
+            except Exception:
+                logger.exception("failed to read sync_state versions")
+                continue
+            if seen is not None:
+                with self._cond:
+                    changed = [name for name, version in versions.items()
+                               if version != seen.get(name) and version > self._announced.get(name, -1)]
+                if changed:
+                    self.publish("sync", {"feeds": changed, "versions": versions})
+            seen = versions
+
+    def _parse_id(self, last_event_id):
+        """Sequence number to resume after, or None when a replay is impossible"""
+        if not last_event_id:
+            return self._seq  # fresh subscriber: only new events
+        boot, _, seq = last_event_id.partition("-")
+        if boot != self.boot or not seq.isdigit():
+            return None
+        seq = int(seq)
+        oldest = self._events[0][0] if self._events else self._seq + 1
+        if seq > self._seq or seq < oldest - 1:
+            return None
+        return seq
+
+    def _format(self, seq, event_type, payload):
+        return f"id: {self.boot}-{seq}\nevent: {event_type}\ndata: {payload}\n\n"
+
+    def stream(self, last_event_id=None, authorized=None):
+        """Generator of SSE frames; blocks between events, sending heartbeats.
+
+        `authorized`, if given, is called once per heartbeat interval; when it
+        returns False the stream sends a `revoked` event and ends.
+        """
+        with self._cond:
+            cursor = self._parse_id(last_event_id)
+            self.subscribers += 1
+            self._ensure_watcher()
+        checked = time.monotonic()
+        try:
+            yield "retry: 3000\n\n"
+            if cursor is None:
+                with self._cond:
+                    cursor = self._seq
+                yield self._format(cursor, "reset", json.dumps({"reason": "replay unavailable"}))
+
+            while True:
+                if authorized is not None and time.monotonic() - checked >= EVENTS_HEARTBEAT:
+                    checked = time.monotonic()
+                    if not authorized():
+                        yield self._format(self._seq, "revoked", json.dumps({"reason": "token revoked"}))
+                        return
+                with self._cond:
+                    pending = [e for e in self._events if e[0] > cursor]
+                    if not pending and not self._closed:
+                        self._cond.wait(EVENTS_HEARTBEAT)
+                        pending = [e for e in self._events if e[0] > cursor]
+                    if self._closed:
+                        return  # the client reconnects, to another worker
+                    if pending and pending[0][0] > cursor + 1:
+                        # Fell behind the ring buffer while waiting
+                        pending = None
+                        cursor = self._seq
+                if pending is None:
+                    yield self._format(cursor, "reset", json.dumps({"reason": "buffer overrun"}))
+                    continue
+                if not pending:
+                    yield f": keepalive {int(time.time())}\n\n"
+                    continue
+                for seq, event_type, payload in pending:
+                    yield self._format(seq, event_type, payload)
+                cursor = pending[-1][0]
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+    def close_streams(self):
+        """End every open stream in this process, e.g. when the worker stops"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "subscribers": self.subscribers,
+                "published": self.published,
+                "buffered": len(self._events),
+            }
+
+bus = EventBus()
+
+def publish(event_type, **data):
+    """Publish after the write commits, so its counter value can be recorded"""
+    feeds = EVENT_FEEDS.get(event_type) or EVENT_FEEDS.get(event_type.split(".", 1)[0], ())
+    bus.publish(event_type, data, feeds)
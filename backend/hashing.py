@@ -0,0 +1,213 @@
+# hashing.py
+import os
+import threading
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Werkzeug method string; raising the iteration count makes existing hashes
+# get rehashed on their next successful login.
+HASH_METHOD = os.getenv("HASH_METHOD", "pbkdf2:sha256:600000")
+HASH_SALT_LENGTH = int(os.getenv("HASH_SALT_LENGTH", "16"))
+# Worker processes doing PBKDF2; 0 hashes inline on the request thread.
+# Both this and HASH_QUEUE_DEPTH are totals for the host: under `serve` each
+# prefork worker gets an even share (at least one hashing process).
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 2)))
+# Jobs allowed to wait for a worker before new ones are turned away with 503
+HASH_QUEUE_DEPTH = int(os.getenv("HASH_QUEUE_DEPTH", "32"))
+# Processes for one batch job (bulk import, batch reset), started per batch and
+# not split across serve workers; concurrent batches each get their own
+HASH_BATCH_WORKERS = int(os.getenv("HASH_BATCH_WORKERS", str(HASH_WORKERS)))
+HASH_TIMEOUT = float(os.getenv("HASH_TIMEOUT", "30"))
+HASH_RETRY_AFTER = int(os.getenv("HASH_RETRY_AFTER", "2"))
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full; maps to 503 + Retry-After"""
+
+    def __init__(self, retry_after=HASH_RETRY_AFTER):
+        super().__init__("password hashing capacity exhausted")
+        self.retry_after = retry_after
+
+def _hash(password, method, salt_length):
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+class HashingService:
+    """Runs password hashing in a process pool behind a bounded admission gate.
+
+    Up to `workers + queue_depth` jobs are admitted at once; anything beyond
+    that fails fast with HashingBusy instead of tying up a request thread.
+    Batches go through `hash_many`, which uses a separate pool.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, queue_depth=HASH_QUEUE_DEPTH, batch_workers=HASH_BATCH_WORKERS):
+        self.workers = max(0, workers)
+        self.batch_workers = max(0, batch_workers)
+        self.capacity = max(1, self.workers) + max(0, queue_depth)
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._counters = {"submitted": 0, "rejected": 0, "rehashed": 0, "pool_restarts": 0,
+                          "batch_hashed": 0}
+        self._in_flight = 0
+
+    def _get_executor(self):
+        # A forked worker process must not reuse its parent's pool
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._counters["pool_restarts"] += 1
+
+    def _call(self, fn, *args):
+        if self.workers == 0:
+            return fn(*args)
+        try:
+            return self._get_executor().submit(fn, *args).result(timeout=HASH_TIMEOUT)
+        except BrokenProcessPool:
+            self._reset_executor()
+            raise HashingBusy()
+        except FutureTimeout:
+            raise HashingBusy()
+
+    def _admit(self, blocking=False, timeout=None):
+        if not self._slots.acquire(blocking=blocking, timeout=timeout):
+            with self._lock:
+                self._counters["rejected"] += 1
+            raise HashingBusy()
+        with self._lock:
+            self._counters["submitted"] += 1
+            self._in_flight += 1
+
+    def _done(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def run(self, fn, *args):
+        self._admit()
+        try:
+            return self._call(fn, *args)
+        finally:
+            self._done()
+
+    def hash(self, password):
+        return self.run(_hash, password, HASH_METHOD, HASH_SALT_LENGTH)
+
+    def verify(self, pwhash, password):
+        return self.run(check_password_hash, pwhash, password)
+
+    def hash_many(self, passwords, timeout=HASH_TIMEOUT):
+        """Hash a batch in a process pool of its own, sized by `batch_workers`.
+
+        Bulk jobs (imports, batch resets) therefore neither queue behind nor
+        take admission slots from interactive logins, and are not limited to
+        this process's share of HASH_WORKERS under `serve`. The pool lives for
+        the call only.
+        """
+        passwords = list(passwords)
+        if self.workers == 0 or self.batch_workers == 0:
+            return [_hash(p, HASH_METHOD, HASH_SALT_LENGTH) for p in passwords]
+        if not passwords:
+            return []
+
+        processes = min(self.batch_workers, len(passwords))
+        rounds = -(-len(passwords) // processes)
+        executor = ProcessPoolExecutor(max_workers=processes)
+        try:
+            results = list(executor.map(
+                _hash, passwords, repeat(HASH_METHOD), repeat(HASH_SALT_LENGTH),
+                timeout=timeout * rounds, chunksize=max(1, rounds // 4),
+            ))
+        except (BrokenProcessPool, FutureTimeout):
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise HashingBusy()
+        executor.shutdown()
+        with self._lock:
+            self._counters["batch_hashed"] += len(results)
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def note_rehash(self):
+        with self._lock:
+            self._counters["rehashed"] += 1
+
+    def warm_up(self):
+        """Start the worker processes now rather than on the first login"""
+        if self.workers:
+            executor = self._get_executor()
+            list(executor.map(_hash, ["warm-up"] * self.workers, [HASH_METHOD] * self.workers,
+                              [HASH_SALT_LENGTH] * self.workers))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "batch_workers": self.batch_workers,
+                "capacity": self.capacity,
+                "in_flight": self._in_flight,
+                **self._counters,
+            }
+
+_service = HashingService()
+
+def configure(workers=HASH_WORKERS, queue_depth=HASH_QUEUE_DEPTH):
+    """Replace the hashing service; call before any hashing (or forking)"""
+    global _service
+    _service.shutdown()
+    _service = HashingService(workers, queue_depth)
+
+def configure_share(processes):
+    """Split HASH_WORKERS and HASH_QUEUE_DEPTH across `processes` server
+    processes, so their combined hashing pool stays about the configured size"""
+    processes = max(1, processes)
+    workers = max(1, HASH_WORKERS // processes) if HASH_WORKERS else 0
+    configure(workers, max(1, HASH_QUEUE_DEPTH // processes))
+
+def hash_password(password):
+    return _service.hash(password)
+
+def verify_password(pwhash, password):
+    return _service.verify(pwhash, password)
+
+def hash_passwords(passwords):
+    return _service.hash_many(passwords)
+
+def needs_rehash(pwhash):
+    """True when a stored hash was made with other parameters than HASH_METHOD"""
+    return pwhash.split("$", 1)[0] != _effective_method()
+
+_method_cache = {}
+
+def _effective_method():
+    # "pbkdf2:sha256" gets Werkzeug's default iteration count appended when
+    # hashing, so learn the full method string from one real hash.
+    if HASH_METHOD not in _method_cache:
+        sample = generate_password_hash("", method=HASH_METHOD, salt_length=1)
+        _method_cache[HASH_METHOD] = sample.split("$", 1)[0]
+    return _method_cache[HASH_METHOD]
+
+def record_rehash():
+    _service.note_rehash()
+
+def warm_up():
+    _service.warm_up()
+
+def shutdown():
+    _service.shutdown()
+
+def hashing_stats():
+    return _service.stats()
@@ -0,0 +1,83 @@
+# http_cache.py
+import datetime
+import hashlib
+import json
+from flask import request, make_response
+
+try:
+    import orjson
+except ImportError:  # pinned in requirements.txt; json is several times slower on large row lists
+    orjson = None
+
+# Opt-in row format: field names once, then one array per row
+COMPACT_MIMETYPE = "application/vnd.auf.compact+json"
+
+def dumps_json(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def wants_compact():
+    """True for ?format=compact or an Accept header naming the compact type.
+
+    A generic */* does not count; only an explicit listing opts in.
+    """
+    if request.args.get("format") == "compact":
+        return True
+    return any(mimetype == COMPACT_MIMETYPE and quality > 0 for mimetype, quality in request.accept_mimetypes)
+
+def compact_rows(rows):
+    """[{col: value}, ...] -> {"columns": [...], "rows": [[...], ...]}"""
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    return {"columns": columns, "rows": [[row.get(c) for c in columns] for row in rows]}
+
+def make_etag(*parts):
+    """Build an ETag from the feed version and anything else the body depends on"""
+    raw = "|".join(str(p) for p in parts)
+    return hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+def _parse_db_timestamp(value):
+    # sync_state.updated_at is SQLite CURRENT_TIMESTAMP, i.e. UTC "YYYY-MM-DD HH:MM:SS"
+    if not value:
+        return None
+    return datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=datetime.timezone.utc)
+
+def conditional_json(build_payload, etag, updated_at=None, rows_key=None):
+    """Answer 304 when the client already holds this version, else the JSON body.
+
+    `build_payload` is only called on a miss, so a revalidation costs one
+    sync_state lookup instead of the full query. `rows_key` names the list of
+    row dicts that is sent in the compact format when the client asks for it.
+    """
+    last_modified = _parse_db_timestamp(updated_at)
+    compact = rows_key is not None and wants_compact()
+    if compact:
+        etag += "-compact"
+
+    # Weak comparison: compression turns our ETag into W/"..." on the wire
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    elif last_modified and request.if_modified_since:
+        not_modified = last_modified <= request.if_modified_since
+    else:
+        not_modified = False
+
+    if not_modified:
+        response = make_response("", 304)
+    else:
+        payload = build_payload()
+        if compact:
+            payload[rows_key] = compact_rows(payload[rows_key])
+            payload["format"] = "compact"
+        response = make_response(dumps_json(payload))
+        response.mimetype = COMPACT_MIMETYPE if compact else "application/json"
+
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # Admin data: only the browser may keep it, and it must always revalidate
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("Authorization")
+    if rows_key is not None:
+        response.vary.add("Accept")
+    return response
@@ -0,0 +1,175 @@
+# login_log.py
+import atexit
+import datetime
+import logging
+import os
+import time
+from collections import Counter
+from db_init import get_pool, prune_refresh_tokens
+from write_behind import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+LOGIN_LOG_ENABLED = os.getenv("LOGIN_LOG_ENABLED", "1").lower() in ("1", "true", "yes")
+LOGIN_LOG_FLUSH_INTERVAL = float(os.getenv("LOGIN_LOG_FLUSH_INTERVAL", "2"))
+LOGIN_LOG_FLUSH_SIZE = int(os.getenv("LOGIN_LOG_FLUSH_SIZE", "500"))
+# Events beyond this many unflushed ones are dropped (and counted), so a
+# login flood cannot grow memory without bound
+LOGIN_LOG_MAX_PENDING = int(os.getenv("LOGIN_LOG_MAX_PENDING", "50000"))
+LOGIN_EVENTS_RETENTION_DAYS = int(os.getenv("LOGIN_EVENTS_RETENTION_DAYS", "30"))
+LOGIN_HOURLY_RETENTION_DAYS = int(os.getenv("LOGIN_HOURLY_RETENTION_DAYS", "90"))
+LOGIN_COMPACT_INTERVAL = float(os.getenv("LOGIN_COMPACT_INTERVAL", "3600"))
+# Rows deleted per transaction while compacting, to keep write locks short
+LOGIN_COMPACT_BATCH = int(os.getenv("LOGIN_COMPACT_BATCH", "5000"))
+USERNAME_LOG_LENGTH = 150
+
+def _rollup(events):
+    """Per-hour and per-day (successes, failures) deltas for a batch"""
+    hourly, daily = Counter(), Counter()
+    for when, _, _, success, _, _ in events:
+        column = "successes" if success else "failures"
+        hourly[(when.strftime("%Y-%m-%d %H"), column)] += 1
+        daily[(when.strftime("%Y-%m-%d"), column)] += 1
+    return hourly, daily
+
+def _upsert_rollup(conn, table, key, deltas):
+    rows = {}
+    for (bucket, column), count in deltas.items():
+        rows.setdefault(bucket, {"successes": 0, "failures": 0})[column] = count
+    conn.executemany(
+        f"INSERT INTO {table} ({key}, successes, failures) VALUES (?, ?, ?) "
+        f"ON CONFLICT({key}) DO UPDATE SET successes = successes + excluded.successes, "
+        "failures = failures + excluded.failures",
+        [(bucket, c["successes"], c["failures"]) for bucket, c in rows.items()],
+    )
+
+class LoginEventLog(BatchWriter):
+    """Buffers login attempts and appends them to login_events in batches.
+
+    Each flush inserts the batch and folds its counts into the hourly and
+    daily rollups in one transaction, so the rollups always match the raw
+    events. The same background thread compacts old rows every
+    `compact_interval` seconds.
+    """
+
+    thread_name = "login-log-flusher"
+    description = "login events"
+
+    def __init__(self, interval=LOGIN_LOG_FLUSH_INTERVAL, max_batch=LOGIN_LOG_FLUSH_SIZE,
+                 max_pending=LOGIN_LOG_MAX_PENDING, compact_interval=LOGIN_COMPACT_INTERVAL):
+        super().__init__(interval, max_batch)
+        self.max_pending = max_pending
+        self.compact_interval = compact_interval
+        self._last_compact = time.monotonic()
+        self._counters.update({"dropped": 0, "rows_compacted": 0})
+
+    def _add(self, event):
+        if len(self._pending) >= self.max_pending:
+            self._counters["dropped"] += 1
+            return False
+        self._pending.append(event)
+        return True
+
+    def _restore(self, batch):
+        # Retry with the next flush, ahead of newer events
+        self._pending[:0] = batch[:max(0, self.max_pending - len(self._pending))]
+
+    def record(self, user_id, username, success, reason=None, ip=None):
+        self._submit((datetime.datetime.now(), user_id, (username or "")[:USERNAME_LOG_LENGTH],
+                      bool(success), reason, ip))
+
+    def _write(self, conn, batch):
+        hourly, daily = _rollup(batch)
+        conn.executemany(
+            "INSERT INTO login_events (created_at, user_id, username, success, reason, ip) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            batch,
+        )
+        _upsert_rollup(conn, "login_stats_hourly", "hour", hourly)
+        _upsert_rollup(conn, "login_stats_daily", "day", daily)
+
+    def _tick(self):
+        if time.monotonic() - self._last_compact >= self.compact_interval:
+            self._last_compact = time.monotonic()
+            try:
+                self.compact()
+            except Exception:
+                logger.exception("login log compaction failed")
+
+    def compact(self, now=None):
+        """Delete raw events and hourly rows past retention, a batch at a time.
+
+        Stale refresh tokens are pruned in the same pass.
+        """
+        now = now or datetime.datetime.now()
+        events_cutoff = now - datetime.timedelta(days=LOGIN_EVENTS_RETENTION_DAYS)
+        hourly_cutoff = (now - datetime.timedelta(days=LOGIN_HOURLY_RETENTION_DAYS)).strftime("%Y-%m-%d %H")
+        removed = 0
+        with get_pool().connection() as conn:
+            while True:
+                cur = conn.execute(
+                    "DELETE FROM login_events WHERE id IN "
+                    "(SELECT id FROM login_events WHERE created_at < ? ORDER BY created_at LIMIT ?)",
+                    (events_cutoff, LOGIN_COMPACT_BATCH),
+                )
+                conn.commit()
+                removed += cur.rowcount
+                if cur.rowcount < LOGIN_COMPACT_BATCH:
+                    break
+            cur = conn.execute("DELETE FROM login_stats_hourly WHERE hour < ?", (hourly_cutoff,))
+            conn.commit()
+            removed += cur.rowcount
+            removed += prune_refresh_tokens(conn, LOGIN_COMPACT_BATCH)
+        with self._lock:
+            self._counters["rows_compacted"] += removed
+        return removed
+
+login_event_log = LoginEventLog()
+
+def record_login_attempt(user_id, username, success, reason=None, ip=None):
+    """Queue one login attempt; `reason` says why a failure failed"""
+    if LOGIN_LOG_ENABLED:
+        login_event_log.record(user_id, username, success, reason, ip)
+
+def flush_login_events():
+    return login_event_log.flush()
+
+def compact_login_events():
+    return login_event_log.compact()
+
+# ---------- Rollup queries ----------
+
+GRANULARITIES = {
+    # name: (table, bucket column, strftime format, default window in days)
+    "hour": ("login_stats_hourly", "hour", "%Y-%m-%d %H", 7),
+    "day": ("login_stats_daily", "day", "%Y-%m-%d", 90),
+}
+
+def login_activity(db, granularity="hour", days=None):
+    """[{bucket, successes, failures}] for the last `days`, oldest first; empty buckets omitted"""
+    table, column, fmt, default_days = GRANULARITIES[granularity]
+    since = (datetime.datetime.now() - datetime.timedelta(days=days or default_days)).strftime(fmt)
+    cur = db.execute(
+        f"SELECT {column} AS bucket, successes, failures FROM {table} WHERE {column} >= ? ORDER BY {column}",
+        (since,),
+    )
+    return [dict(r) for r in cur.fetchall()]
+
+def dormancy(db, thresholds=(30, 90, 180)):
+    """Users whose last successful login is older than each threshold (days).
+
+    users.last_login_time is the per-user rollup of the event log; each count
+    is a range scan on its index.
+    """
+    now = datetime.datetime.now()
+    result = {
+        "never": db.execute("SELECT COUNT(*) FROM users WHERE last_login_time IS NULL").fetchone()[0],
+    }
+    for days in thresholds:
+        cutoff = now - datetime.timedelta(days=days)
+        result[f"over_{days}_days"] = db.execute(
+            "SELECT COUNT(*) FROM users WHERE last_login_time < ?", (cutoff,)
+        ).fetchone()[0]
+    return result
+
+atexit.register(flush_login_events)
@@ -0,0 +1,171 @@
+# metrics.py
+import bisect
+import logging
+import os
+import sqlite3
+import threading
+import time
+from flask import request, g
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+
+# Seconds; spans sub-millisecond cached reads up to multi-second PBKDF2 queues
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format"""
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        names = self.label_names + ("le",)
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (bound,))} {cumulative}")
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+REQUEST_LATENCY = Histogram(
+    "auf_http_request_duration_seconds", "Time spent handling a request, by route.",
+    ("route", "method"),
+)
+REQUEST_COUNT = Counter(
+    "auf_http_requests_total", "Requests handled, by route and status code.",
+    ("route", "method", "status"),
+)
+SQL_LATENCY = Histogram(
+    "auf_sql_query_duration_seconds", "Time spent executing SQL statements, by statement kind.",
+    ("kind",),
+)
+SLOW_QUERIES = Counter(
+    "auf_sql_slow_queries_total", f"Statements slower than SLOW_QUERY_MS ({SLOW_QUERY_MS:g} ms).",
+    ("kind",),
+)
+
+# ---------- SQL timing ----------
+
+def _statement_kind(sql):
+    head = sql.lstrip()[:10].split(None, 1)
+    return head[0].upper() if head else "UNKNOWN"
+
+def _record_query(sql, elapsed):
+    kind = _statement_kind(sql)
+    SQL_LATENCY.observe(elapsed, (kind,))
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc((kind,))
+        logger.warning("slow query (%.1f ms): %s", elapsed * 1000, " ".join(sql.split()))
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection that times every execute()/executemany().
+
+    sqlite3's trace callback only reports statement text, not duration, so
+    timing wraps the calls that step the statement instead. Row fetching
+    after the first step is not included.
+    """
+
+    def execute(self, sql, parameters=(), /):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters, /):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - started)
+
+def connection_factory():
+    return TimedConnection if METRICS_ENABLED else sqlite3.Connection
+
+# ---------- Request middleware ----------
+
+def _before_request():
+    g.request_started = time.perf_counter()
+
+def _after_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        # The URL rule keeps label cardinality bounded (no raw paths/ids)
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_LATENCY.observe(time.perf_counter() - started, (route, request.method))
+        REQUEST_COUNT.inc((route, request.method, str(response.status_code)))
+    return response
+
+def init_app(app):
+    if METRICS_ENABLED:
+        app.before_request(_before_request)
+        app.after_request(_after_request)
+
+# ---------- Exposition ----------
+
+def render(extra=()):
+    """Prometheus text for the built-in metrics plus `extra` families.
+
+    Each extra family is (name, type, help, label_names, {label_values: value}),
+    used for the point-in-time stats other modules already keep.
+    """
+    lines = []
+    for metric in (REQUEST_LATENCY, REQUEST_COUNT, SQL_LATENCY, SLOW_QUERIES):
+        lines.extend(metric.render())
+    for name, kind, help_text, label_names, values in extra:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in values.items():
+            lines.append(f"{name}{_format_labels(label_names, labels)} {value}")
+    return "\n".join(lines) + "\n"
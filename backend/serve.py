@@ -0,0 +1,184 @@
+# serve.py
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator
+from db_init import init_db, get_pool
+import hashing
+from write_behind import flush_last_logins, flush_refresh_tokens
+from login_log import flush_login_events
+from events import bus
+
+logger = logging.getLogger(__name__)
+
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "0"))  # 0 = one per CPU
+SERVE_SHUTDOWN_TIMEOUT = float(os.getenv("SERVE_SHUTDOWN_TIMEOUT", "20"))
+# How long a stopping worker waits for in-flight requests; kept below
+# SERVE_SHUTDOWN_TIMEOUT so the buffers are flushed before the parent kills it
+SERVE_DRAIN_TIMEOUT = float(os.getenv("SERVE_DRAIN_TIMEOUT", "15"))
+
+class _InFlight:
+    """WSGI wrapper counting requests whose response has not been fully sent"""
+
+    def __init__(self, app):
+        self.app = app
+        self.count = 0
+        self._cond = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self._cond:
+            self.count += 1
+        try:
+            result = self.app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        return ClosingIterator(result, self._done)
+
+    def _done(self):
+        with self._cond:
+            self.count -= 1
+            self._cond.notify_all()
+
+    def wait(self, timeout):
+        """True once no request is in flight, False if `timeout` ran out first"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.count == 0, timeout)
+
+def _warm_worker():
+    """Open this worker's first DB connection and start its hashing processes"""
+    with get_pool().connection() as conn:
+        conn.execute("SELECT 1 FROM users LIMIT 1").fetchone()
+    hashing.warm_up()
+
+def _run_worker(app, sock, host, port):
+    # Ctrl-C reaches the whole process group; let the parent coordinate shutdown
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    in_flight = _InFlight(app)
+    server = make_server(host, port, in_flight, threaded=True, fd=sock.fileno())
+
+    def stop(signum, frame):
+        # shutdown() blocks until serve_forever returns, so call it off-thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    _warm_worker()
+    logger.info("worker %d ready", os.getpid())
+    try:
+        server.serve_forever()
+    finally:
+        # Request threads are daemons and os._exit() would cut them off, so
+        # let running requests finish (admin event streams are told to end)
+        # before the buffers they may still add to are flushed
+        bus.close_streams()
+        if not in_flight.wait(SERVE_DRAIN_TIMEOUT):
+            logger.warning("worker %d stopping with %d requests in flight", os.getpid(), in_flight.count)
+        server.server_close()
+        flush_last_logins()
+        flush_refresh_tokens()
+        flush_login_events()
+        hashing.shutdown()
+        get_pool().close_all()
+
+def _spawn(app, sock, host, port):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _run_worker(app, sock, host, port)
+        except Exception:
+            logger.exception("worker %d crashed", os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+def serve(app, host="127.0.0.1", port=5000, workers=SERVE_WORKERS):
+    """Prefork server: initialize the DB once, then fork `workers` processes
+    that accept on one shared listening socket.
+
+    SIGTERM/SIGINT stop the workers gracefully: each stops accepting, waits
+    up to SERVE_DRAIN_TIMEOUT for in-flight requests (open admin event
+    streams are ended), then flushes its buffered writes. Workers that die
+    are replaced.
+
+    Each worker gets HASH_WORKERS // workers hashing processes (at least one)
+    for logins, so those total max(HASH_WORKERS, workers) on the host. Batch
+    jobs hash with up to HASH_BATCH_WORKERS extra processes while they run.
+    """
+    workers = workers or os.cpu_count() or 1
+
+    # Schema setup and migrations run exactly once, before any worker exists
+    init_db(app)
+    # Children must not inherit the parent's SQLite handles
+    get_pool().close_all()
+
+    if not hasattr(os, "fork"):
+        logger.warning("os.fork unavailable; serving with a single process")
+        _warm_worker()
+        make_server(host, port, app, threaded=True).serve_forever()
+        return
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(socket.SOMAXCONN)
+    sock.set_inheritable(True)
+
+    children = set()
+    stopping = threading.Event()
+
+    def request_stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    # Set before forking so every worker inherits its share, not the full pool
+    hashing.configure_share(workers)
+    for _ in range(workers):
+        children.add(_spawn(app, sock, host, port))
+    print(f"Serving on http://{host}:{port} with {workers} workers (pid {os.getpid()})")
+
+    while not stopping.is_set():
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid and pid in children:
+            children.discard(pid)
+            logger.warning("worker %d exited with status %d; restarting", pid, status)
+            children.add(_spawn(app, sock, host, port))
+        time.sleep(0.5)
+
+    print("Shutting down workers...")
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    deadline = time.monotonic() + SERVE_SHUTDOWN_TIMEOUT
+    while children and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            children.discard(pid)
+        else:
+            time.sleep(0.1)
+
+    for pid in children:
+        logger.warning("worker %d did not stop in time; killing", pid)
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    sock.close()
+    sys.exit(0)
@@ -0,0 +1,101 @@
+# spa.py
+import gzip
+import mimetypes
+import os
+import re
+from flask import request, abort, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip variants are built without it
+    brotli = None
+
+# Output of `ng build` (the @angular/build:application builder)
+FRONTEND_DIST = os.getenv("FRONTEND_DIST", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "frontend", "auth-portal", "dist", "auth-portal", "browser",
+))
+# Angular's outputHashing adds an 8-character content hash: main-AB12CD34.js
+HASHED_ASSET = re.compile(r"-[A-Z0-9]{8}\.[A-Za-z0-9]+$")
+ASSET_MAX_AGE = int(os.getenv("ASSET_MAX_AGE", "3600"))  # unhashed files, e.g. favicon.ico
+PRECOMPRESS_EXTENSIONS = (".js", ".mjs", ".css", ".html", ".svg", ".json", ".txt", ".ico", ".xml")
+PRECOMPRESS_MIN_SIZE = 1024
+# Preferred first; a variant is served only if the client accepts it and the file exists
+VARIANTS = (("br", ".br"), ("gzip", ".gz"))
+
+def frontend_available():
+    return os.path.isfile(os.path.join(FRONTEND_DIST, "index.html"))
+
+def _cache_control(path):
+    if path == "index.html":
+        # Always revalidate, so a deploy is picked up on the next load
+        return "no-cache"
+    if HASHED_ASSET.search(path):
+        return "public, max-age=31536000, immutable"
+    return f"public, max-age={ASSET_MAX_AGE}"
+
+def _send_asset(path):
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    for encoding, suffix in VARIANTS:
+        if request.accept_encodings[encoding] and os.path.isfile(os.path.join(FRONTEND_DIST, path + suffix)):
+            response = send_from_directory(FRONTEND_DIST, path + suffix, mimetype=mimetype)
+            response.headers["Content-Encoding"] = encoding
+            break
+    else:
+        response = send_from_directory(FRONTEND_DIST, path, mimetype=mimetype)
+    # Each variant is its own file, so send_file's ETag already differs per encoding
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = _cache_control(path)
+    return response
+
+def serve_frontend(path=""):
+    """Static files of the Angular build; other paths get index.html so the
+    client-side router can handle /admin, /user and deep links."""
+    if path.startswith("api/"):
+        abort(404)
+    full = safe_join(FRONTEND_DIST, path) if path else None
+    if full and os.path.isfile(full):
+        return _send_asset(path)
+    if "." in path.rsplit("/", 1)[-1]:
+        abort(404)  # a missing asset, not a route
+    return _send_asset("index.html")
+
+def register_frontend(app):
+    app.add_url_rule("/", view_func=serve_frontend, methods=["GET"])
+    app.add_url_rule("/<path:path>", view_func=serve_frontend, methods=["GET"])
+
+def _compressors():
+    yield ".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    if brotli is not None:
+        yield ".br", lambda data: brotli.compress(data, quality=11)
+
+def precompress(dist=FRONTEND_DIST):
+    """Write .gz (and .br with the brotli package) next to each text asset.
+
+    Variants newer than their source are kept, so re-running after a build
+    only compresses what changed. Returns the number of files written.
+    """
+    written = 0
+    for root, _, files in os.walk(dist):
+        for name in files:
+            source = os.path.join(root, name)
+            if not name.endswith(PRECOMPRESS_EXTENSIONS) or os.path.getsize(source) < PRECOMPRESS_MIN_SIZE:
+                continue
+            data = None
+            for suffix, compress in _compressors():
+                target = source + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+                    continue
+                if data is None:
+                    with open(source, "rb") as f:
+                        data = f.read()
+                packed = compress(data)
+                if len(packed) >= len(data):
+                    # Not worth a variant; drop one left over from an older build
+                    if os.path.exists(target):
+                        os.remove(target)
+                    continue
+                with open(target, "wb") as out:
+                    out.write(packed)
+                written += 1
+    return written
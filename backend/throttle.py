@@ -0,0 +1,122 @@
+# throttle.py
+import math
+import os
+import threading
+import time
+from cache import LRUCache
+
+# Token buckets: sustained requests per minute and burst size, per key.
+# The per-IP limits are deployment-specific: a whole site behind one NAT
+# address logs in at shift change, so size them for the largest site.
+LOGIN_RATE_PER_USER = float(os.getenv("LOGIN_RATE_PER_USER", "10"))
+LOGIN_RATE_PER_IP = float(os.getenv("LOGIN_RATE_PER_IP", "300"))
+LOGIN_BURST_PER_USER = int(os.getenv("LOGIN_BURST_PER_USER", "5"))
+LOGIN_BURST_PER_IP = int(os.getenv("LOGIN_BURST_PER_IP", "200"))
+# Progressive lockout: after this many failures the key is locked for
+# LOCKOUT_BASE_SECONDS, doubling with every further failure up to the cap.
+# IPs get a higher threshold since many employees may share one NAT address,
+# sized like the per-IP rate so a site's typos cannot lock everyone out.
+LOCKOUT_THRESHOLD_USER = int(os.getenv("LOCKOUT_THRESHOLD_USER", "5"))
+LOCKOUT_THRESHOLD_IP = int(os.getenv("LOCKOUT_THRESHOLD_IP", "300"))
+LOCKOUT_BASE_SECONDS = float(os.getenv("LOCKOUT_BASE_SECONDS", "30"))
+LOCKOUT_MAX_SECONDS = float(os.getenv("LOCKOUT_MAX_SECONDS", "900"))
+# Failure counts start over once a key has been quiet for this long
+LOCKOUT_WINDOW_SECONDS = float(os.getenv("LOCKOUT_WINDOW_SECONDS", "900"))
+# Bounds memory: least recently seen keys are forgotten first
+THROTTLE_MAX_KEYS = int(os.getenv("THROTTLE_MAX_KEYS", "100000"))
+
+class _KeyState:
+    __slots__ = ("tokens", "updated", "failures", "last_failure", "locked_until")
+
+    def __init__(self, burst, now):
+        self.tokens = float(burst)
+        self.updated = now
+        self.failures = 0
+        self.last_failure = 0.0
+        self.locked_until = 0.0
+
+class Throttle:
+    """Token-bucket rate limiter with progressive lockout, keyed by arbitrary strings"""
+
+    def __init__(self, name, rate_per_minute, burst, lockout_threshold, max_keys=THROTTLE_MAX_KEYS):
+        self.name = name
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        self.lockout_threshold = max(1, lockout_threshold)
+        self._states = LRUCache(max_keys)
+        self._lock = threading.Lock()
+        self._counters = {"allowed": 0, "rate_limited": 0, "locked_out": 0, "lockouts": 0}
+
+    def _state(self, key, now):
+        state = self._states.get(key)
+        if state is None:
+            state = _KeyState(self.burst, now)
+            self._states.set(key, state)
+        return state
+
+    def hit(self, key):
+        """Take one token for `key`; returns seconds to wait, or 0 if allowed"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(key, now)
+            if state.locked_until > now:
+                self._counters["locked_out"] += 1
+                return state.locked_until - now
+            state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+            state.updated = now
+            if state.tokens < 1:
+                self._counters["rate_limited"] += 1
+                return (1 - state.tokens) / self.rate if self.rate else LOCKOUT_MAX_SECONDS
+            state.tokens -= 1
+            self._counters["allowed"] += 1
+            return 0
+
+    def failure(self, key):
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(key, now)
+            if now - state.last_failure > LOCKOUT_WINDOW_SECONDS:
+                state.failures = 0
+            state.failures += 1
+            state.last_failure = now
+            over = state.failures - self.lockout_threshold
+            if over >= 0:
+                state.locked_until = now + min(LOCKOUT_MAX_SECONDS, LOCKOUT_BASE_SECONDS * (2 ** min(over, 30)))
+                self._counters["lockouts"] += 1
+
+    def success(self, key):
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                state.failures = 0
+                state.locked_until = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {"tracked_keys": len(self._states), **self._counters}
+
+user_throttle = Throttle("user", LOGIN_RATE_PER_USER, LOGIN_BURST_PER_USER, LOCKOUT_THRESHOLD_USER)
+ip_throttle = Throttle("ip", LOGIN_RATE_PER_IP, LOGIN_BURST_PER_IP, LOCKOUT_THRESHOLD_IP)
+
+def check(username, ip):
+    """Seconds the caller must wait before trying again (0 = go ahead)"""
+    wait = ip_throttle.hit(ip)
+    if not wait and username:
+        wait = user_throttle.hit(username.lower())
+    return wait
+
+def record_failure(username, ip):
+    ip_throttle.failure(ip)
+    if username:
+        user_throttle.failure(username.lower())
+
+def record_success(username):
+    # IP failures are left to age out of the window, so one valid account
+    # cannot be used to reset an address that is guessing at others
+    user_throttle.success(username.lower())
+
+def retry_after_header(wait):
+    return str(max(1, math.ceil(wait)))
+
+def throttle_stats():
+    return {"user": user_throttle.stats(), "ip": ip_throttle.stats()}
@@ -0,0 +1,74 @@
+# user_cache.py
+import os
+import threading
+import time
+from cache import LRUCache
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+# Upper bound on staleness for writes made by other worker processes, which
+# cannot invalidate this process's entries
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "5"))
+
+# The columns the auth paths read; everything else comes from the table
+USER_CACHE_COLUMNS = ("slno", "username", "password", "is_admin", "must_reset", "token_version")
+
+_by_id = LRUCache(USER_CACHE_SIZE)
+_by_name = LRUCache(USER_CACHE_SIZE)  # username -> slno
+_lock = threading.Lock()
+_generation = 0
+
+def _load(db, column, value):
+    with _lock:
+        started = _generation
+    row = db.execute(
+        f"SELECT {', '.join(USER_CACHE_COLUMNS)} FROM users WHERE {column} = ?", (value,)
+    ).fetchone()
+    if row is None:
+        return None  # misses are not cached, so inserts need no invalidation
+    user = dict(row)
+    with _lock:
+        # An invalidation while we were reading means the row may be stale
+        if started == _generation:
+            expires_at = time.time() + USER_CACHE_TTL
+            _by_id.set(user["slno"], user, expires_at=expires_at)
+            _by_name.set(user["username"], user["slno"], expires_at=expires_at)
+    return user
+
+def get_user(db, user_id):
+    """Cached auth columns of a user by slno, or None"""
+    user = _by_id.get(user_id)
+    if user is not None:
+        return user
+    return _load(db, "slno", user_id)
+
+def get_user_by_username(db, username):
+    """Cached auth columns of a user by username, or None"""
+    user_id = _by_name.get(username)
+    if user_id is not None:
+        user = _by_id.get(user_id)
+        # The name index may point at a row that was renamed since
+        if user is not None and user["username"] == username:
+            return user
+    return _load(db, "username", username)
+
+def invalidate_user(user_id, *usernames):
+    """Drop a user's entries; call after the write commits.
+
+    Pass the old username on renames so the stale name lookup goes too.
+    """
+    global _generation
+    with _lock:
+        _generation += 1
+        user = _by_id.pop(user_id)
+        for name in usernames + ((user["username"],) if user else ()):
+            _by_name.pop(name)
+
+def clear_user_cache():
+    global _generation
+    with _lock:
+        _generation += 1
+        _by_id.clear()
+        _by_name.clear()
+
+def user_cache_stats():
+    return {"by_id": _by_id.stats(), "by_username": _by_name.stats()}
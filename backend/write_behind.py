@@ -0,0 +1,238 @@
+# write_behind.py
+import atexit
+import logging
+import os
+import threading
+from db_init import get_pool
+
+logger = logging.getLogger(__name__)
+
+# Off by default: last_login_time and the login's refresh token are then
+# written synchronously in login(). When on, a refresh token issued by another
+# worker can be unknown for up to LOGIN_FLUSH_INTERVAL seconds; clients only
+# refresh after the access token expires, so this is normally invisible.
+LOGIN_WRITE_BEHIND = os.getenv("LOGIN_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+LOGIN_FLUSH_INTERVAL = float(os.getenv("LOGIN_FLUSH_INTERVAL", "2"))
+LOGIN_FLUSH_SIZE = int(os.getenv("LOGIN_FLUSH_SIZE", "500"))
+# Refresh tokens beyond this many unflushed ones are written synchronously
+# instead, so failing flushes cannot grow memory without bound
+REFRESH_TOKEN_MAX_PENDING = int(os.getenv("REFRESH_TOKEN_MAX_PENDING", "50000"))
+
+class BatchWriter:
+    """Buffers items in memory and writes them in batches from a background thread.
+
+    A flush runs every `interval` seconds, as soon as `max_batch` items are
+    pending, and whenever `flush()` is called (e.g. at exit). Each batch is
+    written in one transaction; if that fails the batch is put back for the
+    next flush. Subclasses decide how items are buffered (`_add`,
+    `_restore`) and written (`_write`).
+    """
+
+    thread_name = "batch-writer"
+    description = "buffered rows"
+
+    def __init__(self, interval, max_batch):
+        self.interval = interval
+        self.max_batch = max_batch
+        self._pending = self._empty()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._counters = {"recorded": 0, "flushes": 0, "rows_written": 0, "flush_errors": 0}
+
+    def _empty(self):
+        return []
+
+    def _add(self, item):
+        """Buffer one item (lock held); return False if it was dropped"""
+        self._pending.append(item)
+        return True
+
+    def _restore(self, batch):
+        """Put a batch that failed to write back in front of newer items (lock held)"""
+        self._pending[:0] = batch
+
+    def _write(self, conn, batch):
+        raise NotImplementedError
+
+    def _tick(self):
+        """Extra periodic work on the flusher thread, after each flush"""
+
+    def _ensure_thread(self):
+        # Started lazily so each forked worker runs its own flusher
+        if self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+        self._thread_pid = os.getpid()
+        self._thread.start()
+
+    def _submit(self, item):
+        """Buffer an item; returns False if it was dropped"""
+        with self._lock:
+            self._ensure_thread()
+            if not self._add(item):
+                return False
+            self._counters["recorded"] += 1
+            full = len(self._pending) >= self.max_batch
+        if full:
+            self._wake.set()
+        return True
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+            self._tick()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, self._empty()
+            try:
+                with get_pool().connection() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        self._write(conn, batch)
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+            except Exception:
+                logger.exception("failed to flush %d %s", len(batch), self.description)
+                with self._lock:
+                    self._counters["flush_errors"] += 1
+                    self._restore(batch)
+                return 0
+            with self._lock:
+                self._counters["flushes"] += 1
+                self._counters["rows_written"] += len(batch)
+            return len(batch)
+
+    def stats(self):
+        with self._lock:
+            return {"pending": len(self._pending), **self._counters}
+
+class LastLoginBuffer(BatchWriter):
+    """Coalesces last_login_time updates and writes them in one transaction.
+
+    Only the newest timestamp per user is kept, so memory is bounded by the
+    number of distinct users logging in between flushes.
+    """
+
+    thread_name = "last-login-flusher"
+    description = "last_login_time updates"
+
+    def __init__(self, interval=LOGIN_FLUSH_INTERVAL, max_pending=LOGIN_FLUSH_SIZE):
+        super().__init__(interval, max_pending)
+
+    def _empty(self):
+        return {}
+
+    def _add(self, item):
+        user_id, when = item
+        previous = self._pending.get(user_id)
+        if previous is None or when > previous:
+            self._pending[user_id] = when
+        return True
+
+    def _restore(self, batch):
+        # Put them back unless a newer login arrived meanwhile
+        for item in batch.items():
+            self._add(item)
+
+    def record(self, user_id, when):
+        self._submit((user_id, when))
+
+    def _write(self, conn, batch):
+        # MAX() keeps a newer value written by another worker process
+        conn.executemany(
+            "UPDATE users SET last_login_time = MAX(COALESCE(last_login_time, ''), ?) "
+            "WHERE slno = ?",
+            [(when, user_id) for user_id, when in batch.items()],
+        )
+
+last_login_buffer = LastLoginBuffer()
+
+def record_last_login(db, user_id, when):
+    """Store a login timestamp; returns True if it was buffered rather than executed on `db`"""
+    if LOGIN_WRITE_BEHIND:
+        last_login_buffer.record(user_id, when)
+        return True
+    db.execute("UPDATE users SET last_login_time = ? WHERE slno = ?", (when, user_id))
+    return False
+
+REFRESH_TOKEN_INSERT = (
+    "INSERT INTO refresh_tokens (token_hash, user_id, family, token_version, expires_at) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+
+class RefreshTokenBuffer(BatchWriter):
+    """Batches the refresh tokens issued at login, so login does not write.
+
+    Rows are keyed by token hash, so /api/refresh can tell whether an unknown
+    token is waiting here before forcing a flush.
+    """
+
+    thread_name = "refresh-token-flusher"
+    description = "refresh tokens"
+
+    def __init__(self, interval=LOGIN_FLUSH_INTERVAL, max_batch=LOGIN_FLUSH_SIZE,
+                 max_pending=REFRESH_TOKEN_MAX_PENDING):
+        super().__init__(interval, max_batch)
+        self.max_pending = max_pending
+        self._counters.update({"overflow": 0, "dropped": 0})
+
+    def _empty(self):
+        return {}
+
+    def _add(self, values):
+        if len(self._pending) >= self.max_pending:
+            self._counters["overflow"] += 1
+            return False
+        self._pending[values[0]] = values
+        return True
+
+    def _restore(self, batch):
+        # Retry with the next flush; what no longer fits is lost
+        room = max(0, self.max_pending - len(self._pending))
+        self._counters["dropped"] += max(0, len(batch) - room)
+        restored = dict(list(batch.items())[:room])
+        restored.update(self._pending)
+        self._pending = restored
+
+    def record(self, values):
+        """Buffer a row; returns False if the buffer is full"""
+        return self._submit(values)
+
+    def is_pending(self, token_hash):
+        with self._lock:
+            return token_hash in self._pending
+
+    def _write(self, conn, batch):
+        conn.executemany(REFRESH_TOKEN_INSERT, batch.values())
+
+refresh_token_buffer = RefreshTokenBuffer()
+
+def record_refresh_token(db, values):
+    """Store a login's refresh token row; returns True if it was buffered rather than executed on `db`"""
+    if LOGIN_WRITE_BEHIND and refresh_token_buffer.record(values):
+        return True
+    db.execute(REFRESH_TOKEN_INSERT, values)
+    return False
+
+def flush_last_logins():
+    return last_login_buffer.flush()
+
+def flush_refresh_tokens(token_hash=None):
+    """Write buffered refresh tokens; with `token_hash`, only if that one is among them"""
+    if token_hash is not None and not refresh_token_buffer.is_pending(token_hash):
+        return 0
+    return refresh_token_buffer.flush()
+
+atexit.register(flush_last_logins)
+atexit.register(flush_refresh_tokens)
@@ -1,6 +1,8 @@
-import { Component, OnInit } from '@angular/core';
+import { Component, OnDestroy, OnInit } from '@angular/core';
 import { CommonModule } from '@angular/common';
 import { FormsModule } from '@angular/forms';
+import { Subject, Subscription, of } from 'rxjs';
+import { debounceTime, distinctUntilChanged, switchMap } from 'rxjs/operators';
 import { ApiService } from '../services/api';
 
 interface User {
@@ -17,6 +19,24 @@ interface User {
   admin_note: string;
 }
 
+interface DashboardStats {
+  total_users: number;
+  admin_users: number;
+  pending_resets: number;
+  must_reset_users: number;
+  logins_24h: number;
+}
+
+// One CSV cell: quoted, with a leading apostrophe on values a spreadsheet
+// would otherwise run as a formula (same rules as the server's CSV export)
+function csvField(value: unknown): string {
+  let text = value === null || value === undefined ? '' : String(value);
+  if (/^[=+\-@\t\r]/.test(text)) {
+    text = "'" + text;
+  }
+  return '"' + text.replace(/"/g, '""') + '"';
+}
+
 interface ResetRequest {
   user_id: number;
   username: string;
@@ -32,7 +52,7 @@ interface ResetRequest {
   templateUrl: './admin-dashboard.html',
   styleUrls: ['./admin-dashboard.css']
 })
-export class AdminDashboardComponent implements OnInit {
+export class AdminDashboardComponent implements OnInit, OnDestroy {
   isLoggedIn = false;
   username = '';
   password = '';
@@ -54,33 +74,142 @@ export class AdminDashboardComponent implements OnInit {
   newPassword = '';
   // Data from API
   users: User[] = [];
+  usersNextCursor: string | null = null;
+  usersSyncCursor: number | null = null;
+  userSearch = '';
+  searchResults: User[] | null = null;
   resetRequests: ResetRequest[] = [];
+  resetRequestsCursor: number | null = null;
+  stats: DashboardStats | null = null;
+  loginsWeek = { successes: 0, failures: 0 };
+  dormancy: { [bucket: string]: number } | null = null;
   currentAdminUsername = '';
   selectedResetRequest: ResetRequest | null = null;
   newResetPassword = '';
-
-  constructor(private api: ApiService) {}
+  private eventsSubscription: Subscription | null = null;
+  private userSearch$ = new Subject<string>();
+  private searchSubscription: Subscription;
+
+  constructor(private api: ApiService) {
+    // Query the server index as the admin types; an empty box shows the list
+    this.searchSubscription = this.userSearch$.pipe(
+      debounceTime(250),
+      distinctUntilChanged(),
+      switchMap(q => q ? this.api.searchUsers(q) : of(null))
+    ).subscribe({
+      next: (response) => {
+        this.searchResults = response ? response.users as any : null;
+      },
+      error: (error) => {
+        console.error('Error searching users:', error);
+      }
+    });
+  }
 
   ngOnInit() {
     // Check if already logged in
     if (this.api.isLoggedIn()) {
       this.isLoggedIn = true;
       this.loadData();
+      this.startLiveUpdates();
     }
   }
 
+  ngOnDestroy() {
+    this.stopLiveUpdates();
+    this.searchSubscription.unsubscribe();
+  }
+
+  // Refresh only what an event touched instead of polling
+  startLiveUpdates() {
+    this.stopLiveUpdates();
+    this.eventsSubscription = this.api.adminEvents().subscribe({
+      next: (event) => {
+        // Deltas keep the pages already loaded; logins do not produce events
+        if (event.type === 'reset') {
+          this.loadData();
+          return;
+        }
+        if (event.type === 'sync') {
+          // Changes made through another server process
+          if (event.data.feeds.includes('forgot_requests')) this.loadResetRequests();
+          if (event.data.feeds.includes('accounts')) this.loadUserChanges();
+        } else if (event.type.startsWith('forgot_request.')) {
+          this.loadResetRequests();
+          if (event.type === 'forgot_request.resolved') this.loadUserChanges();
+        } else {
+          this.loadUserChanges();
+        }
+        this.loadStats();
+      },
+      error: (error) => {
+        console.error('Admin event stream error:', error);
+        // Usually an expired access token; reconnect with the refreshed one
+        setTimeout(() => {
+          if (this.isLoggedIn && this.eventsSubscription) this.startLiveUpdates();
+        }, 5000);
+      }
+    });
+  }
+
+  stopLiveUpdates() {
+    this.eventsSubscription?.unsubscribe();
+    this.eventsSubscription = null;
+  }
+
   loadData() {
+    this.loadStats();
+    this.loadLoginActivity();
     this.loadUsers();
     this.loadResetRequests();
   }
 
+  loadStats() {
+    this.api.getStats().subscribe({
+      next: (response) => {
+        this.stats = response.stats;
+      },
+      error: (error) => {
+        console.error('Error loading stats:', error);
+      }
+    });
+  }
+
+  // Login activity and dormancy come from small rollup tables
+  loadLoginActivity() {
+    this.api.getLoginActivity('day', 7).subscribe({
+      next: (response) => {
+        this.loginsWeek = response.series.reduce(
+          (total, day) => ({
+            successes: total.successes + day.successes,
+            failures: total.failures + day.failures
+          }),
+          { successes: 0, failures: 0 }
+        );
+      },
+      error: (error) => {
+        console.error('Error loading login activity:', error);
+      }
+    });
+    this.api.getDormantUsers().subscribe({
+      next: (response) => {
+        this.dormancy = response.dormancy;
+      },
+      error: (error) => {
+        console.error('Error loading dormant users:', error);
+      }
+    });
+  }
+
   loadUsers() {
     this.api.getAllUsers().subscribe({
       next: (response) => {
         this.users = response.users as any; // Quick fix
         // Or more specifically:
         // this.users = response.users as User[];
-        
+        this.usersNextCursor = response.next_cursor;
+        this.usersSyncCursor = response.sync_cursor;
+
         // Find admin username
         const admin = this.users.find(u => u.is_admin);
         if (admin) {
@@ -97,10 +226,53 @@ export class AdminDashboardComponent implements OnInit {
     });
   }
 
+  // Append the next page of users to the list
+  loadMoreUsers() {
+    if (!this.usersNextCursor) return;
+    this.api.getAllUsers({ cursor: this.usersNextCursor }).subscribe({
+      next: (response) => {
+        this.users = this.users.concat(response.users as any);
+        this.usersNextCursor = response.next_cursor;
+      },
+      error: (error) => {
+        console.error('Error loading more users:', error);
+      }
+    });
+  }
+
+  // Update loaded users in place from a `since` delta. New users are only
+  // appended once every page is loaded; otherwise "Load more" reaches them.
+  loadUserChanges() {
+    if (this.usersSyncCursor === null) {
+      this.loadUsers();
+      return;
+    }
+    this.api.getAllUsers({ since: this.usersSyncCursor, limit: 1000 }).subscribe({
+      next: (response) => {
+        const changed = new Map((response.users as any as User[]).map(u => [u.slno, u] as [number, User]));
+        this.users = this.users.map(u => changed.get(u.slno) ?? u);
+        if (!this.usersNextCursor) {
+          const loaded = new Set(this.users.map(u => u.slno));
+          this.users = this.users.concat([...changed.values()].filter(u => !loaded.has(u.slno)));
+        }
+        this.usersSyncCursor = response.sync_cursor;
+        if (response.has_more) this.loadUserChanges();
+      },
+      error: (error) => {
+        console.error('Error loading user changes:', error);
+      }
+    });
+  }
+
   loadResetRequests() {
-    this.api.getResetRequests().subscribe({
+    this.api.getResetRequests(this.resetRequestsCursor).subscribe({
       next: (response) => {
-        this.resetRequests = response.requests;
+        if (this.resetRequestsCursor === null) {
+          this.resetRequests = response.requests;
+        } else {
+          this.applyResetRequestChanges(response.requests);
+        }
+        this.resetRequestsCursor = response.cursor;
       },
       error: (error) => {
         console.error('Error loading reset requests:', error);
@@ -108,6 +280,15 @@ export class AdminDashboardComponent implements OnInit {
     });
   }
 
+  // Merge a delta from the server: drop changed rows, keep the ones still pending
+  applyResetRequestChanges(changes: ResetRequest[]) {
+    const changedIds = new Set(changes.map(r => r.user_id));
+    this.resetRequests = this.resetRequests
+      .filter(r => !changedIds.has(r.user_id))
+      .concat(changes.filter(r => r.status === 'pending'))
+      .sort((a, b) => (b.requested_at || '').localeCompare(a.requested_at || ''));
+  }
+
   // Login with credentials
   login() {
     if (!this.username || !this.password) {
@@ -123,6 +304,7 @@ export class AdminDashboardComponent implements OnInit {
         this.isLoggedIn = true;
         this.currentAdminUsername = this.username;
         this.loadData();
+        this.startLiveUpdates();
         alert('Admin login successful!');
         this.isLoading = false;
       },
@@ -257,11 +439,41 @@ Password: ${this.newPassword}
 
   closeUsersListModal() {
     this.showUsersListModal = false;
+    this.userSearch = '';
+    this.searchResults = null;
+    this.userSearch$.next('');
   }
 
-  // Get total user count
+  onUserSearch() {
+    this.userSearch$.next(this.userSearch.trim());
+  }
+
+  // Save the full user list as a CSV file
+  exportUsers() {
+    this.api.exportUsers('csv').subscribe({
+      next: (blob) => {
+        const url = URL.createObjectURL(blob);
+        const link = document.createElement('a');
+        link.href = url;
+        link.download = `users-${new Date().toISOString().slice(0, 10)}.csv`;
+        link.click();
+        URL.revokeObjectURL(url);
+      },
+      error: (error) => {
+        console.error('Error exporting users:', error);
+        alert('Failed to export users.');
+      }
+    });
+  }
+
+  // Search hits while a query is entered, otherwise the paged list
+  get displayedUsers(): User[] {
+    return this.searchResults ?? this.users;
+  }
+
+  // Get total user count (server-side counter once loaded)
   getTotalUsers(): number {
-    return this.users.length;
+    return this.stats ? this.stats.total_users : this.users.length;
   }
 
   // Open Reset Password Modal
@@ -278,6 +490,39 @@ Password: ${this.newPassword}
     this.newResetPassword = '';
   }
 
+  // Reset every pending request with generated passwords, saved as a CSV
+  resetAllPendingRequests() {
+    if (!confirm(`Reset passwords for all ${this.resetRequests.length} pending request(s)?`)) {
+      return;
+    }
+    this.isLoading = true;
+    this.api.batchResetPasswords({
+      filter: { forgot_request_status: 'pending' },
+      admin_note: `Password reset by admin on ${new Date().toLocaleString()}`
+    }).subscribe({
+      next: (response) => {
+        this.isLoading = false;
+        const rows = response.results
+          .filter((r: any) => r.status === 'reset')
+          .map((r: any) => [r.username, r.new_password].map(csvField).join(','));
+        const blob = new Blob([['username,new_password', ...rows].join('\r\n')], { type: 'text/csv' });
+        const url = URL.createObjectURL(blob);
+        const link = document.createElement('a');
+        link.href = url;
+        link.download = `password-resets-${new Date().toISOString().slice(0, 10)}.csv`;
+        link.click();
+        URL.revokeObjectURL(url);
+        alert(`✅ ${response.summary.reset} password(s) reset. The new credentials were downloaded as a CSV file.`);
+        this.loadData();
+      },
+      error: (error) => {
+        this.isLoading = false;
+        console.error('Batch reset error:', error);
+        alert('Error: ' + (error.error?.error || 'Failed to reset passwords. Please try again.'));
+      }
+    });
+  }
+
   // Reset user password
   resetUserPassword() {
     if (!this.selectedResetRequest || !this.newResetPassword) {
@@ -325,12 +570,18 @@ Please send these credentials to the user.`);
 
   // Logout
   logout() {
+    this.stopLiveUpdates();
     this.api.logout();
     this.isLoggedIn = false;
     this.username = '';
     this.password = '';
     this.users = [];
+    this.usersNextCursor = null;
     this.resetRequests = [];
+    this.resetRequestsCursor = null;
+    this.stats = null;
+    this.loginsWeek = { successes: 0, failures: 0 };
+    this.dormancy = null;
     this.currentAdminUsername = '';
     this.showLogoutDropdown = false; // Close dropdown on logout
   }
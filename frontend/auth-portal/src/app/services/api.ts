@@ -1,7 +1,7 @@
 import { Injectable } from '@angular/core';
-import { HttpClient, HttpHeaders } from '@angular/common/http';
+import { HttpClient, HttpHeaders, HttpParams } from '@angular/common/http';
 import { Observable, BehaviorSubject, Subscription } from 'rxjs';
-import { tap } from 'rxjs/operators';
+import { finalize, map, shareReplay, tap } from 'rxjs/operators';
 import { Router } from '@angular/router';
 
 interface User {
@@ -18,6 +18,38 @@ interface User {
   admin_note: string;
 }
 
+interface UserPage {
+  users: User[];
+  next_cursor: string | null;
+  has_more: boolean;
+  limit: number;
+  // Change cursor to pass back as `since` for a delta of later changes
+  sync_cursor: number;
+}
+
+interface UserListParams {
+  cursor?: string;
+  since?: number;
+  limit?: number;
+  sort?: string;
+  order?: 'asc' | 'desc';
+  is_admin?: boolean;
+  must_reset?: boolean;
+  forgot_request_status?: string;
+  created_after?: string;
+  created_before?: string;
+  last_login_after?: string;
+  last_login_before?: string;
+}
+
+interface DashboardStats {
+  total_users: number;
+  admin_users: number;
+  pending_resets: number;
+  must_reset_users: number;
+  logins_24h: number;
+}
+
 interface ResetRequest {
   user_id: number;
   username: string;
@@ -28,6 +60,8 @@ interface ResetRequest {
 
 interface LoginResponse {
   access_token: string;
+  refresh_token?: string;
+  expires_in?: number;
   message: string;
   user?: any;
 }
@@ -35,6 +69,8 @@ interface LoginResponse {
 // User-specific interfaces
 interface UserLoginResponse {
   access_token: string;
+  refresh_token?: string;
+  expires_in?: number;
   message: string;
   user?: any;
   must_reset?: boolean;
@@ -50,19 +86,46 @@ interface ForgotPasswordResponse {
   success: boolean;
 }
 
+// Turn {columns, rows} blocks of a compact response back into row objects
+function expandCompact<T>(body: any): T {
+  if (!body || body.format !== 'compact') {
+    return body;
+  }
+  const result: any = {};
+  for (const [key, value] of Object.entries<any>(body)) {
+    if (key === 'format') continue;
+    if (value && Array.isArray(value.columns) && Array.isArray(value.rows)) {
+      result[key] = value.rows.map((row: any[]) => {
+        const item: any = {};
+        value.columns.forEach((column: string, i: number) => item[column] = row[i]);
+        return item;
+      });
+    } else {
+      result[key] = value;
+    }
+  }
+  return result;
+}
+
 @Injectable({
   providedIn: 'root'
 })
 export class ApiService {
-  private baseUrl = 'http://localhost:5000/api'; 
+  // Same origin when Flask serves the production build; the ng serve dev
+  // server on :4200 talks to the API cross-origin
+  private baseUrl = window.location.port === '4200' ? 'http://localhost:5000/api' : '/api';
   private tokenKey = 'admin_token';
+  private refreshTokenKey = 'admin_refresh_token';
+  private refreshTimer: ReturnType<typeof setTimeout> | null = null;
+  private refreshInFlight: Observable<string> | null = null;
   private currentUserSubject = new BehaviorSubject<any>(null);
   public currentUser$ = this.currentUserSubject.asObservable();
 
   constructor(private http: HttpClient, private router: Router) {
     const token = this.getToken();
     if (token) {
-      // Token exists, user was previously logged in
+      // Token exists, user was previously logged in; keep it fresh
+      this.scheduleRefresh();
     }
   }
 
@@ -86,6 +149,61 @@ export class ApiService {
 
   private removeToken(): void {
     sessionStorage.removeItem(this.tokenKey);
+    sessionStorage.removeItem(this.refreshTokenKey);
+    if (this.refreshTimer) {
+      clearTimeout(this.refreshTimer);
+      this.refreshTimer = null;
+    }
+  }
+
+  // Keep the access/refresh pair from a login, refresh or credential change
+  private storeTokens(response: { access_token?: string; refresh_token?: string }): void {
+    if (response.access_token) {
+      this.setToken(response.access_token);
+    }
+    if (response.refresh_token) {
+      sessionStorage.setItem(this.refreshTokenKey, response.refresh_token);
+    }
+    this.scheduleRefresh();
+  }
+
+  // Renew the access token a minute before its `exp` claim
+  private scheduleRefresh(): void {
+    if (this.refreshTimer) {
+      clearTimeout(this.refreshTimer);
+      this.refreshTimer = null;
+    }
+    const token = this.getToken();
+    if (!token || !sessionStorage.getItem(this.refreshTokenKey)) return;
+    let exp: number;
+    try {
+      exp = JSON.parse(atob(token.split('.')[1].replace(/-/g, '+').replace(/_/g, '/'))).exp;
+    } catch {
+      return;
+    }
+    const delay = Math.max(0, exp * 1000 - Date.now() - 60_000);
+    this.refreshTimer = setTimeout(() => this.refreshSession().subscribe({ error: () => {} }), delay);
+  }
+
+  // Trade the refresh token for a new pair without asking for the password.
+  // Concurrent callers share one request: a refresh token is single-use.
+  refreshSession(): Observable<string> {
+    if (!this.refreshInFlight) {
+      const refreshToken = sessionStorage.getItem(this.refreshTokenKey);
+      this.refreshInFlight = this.http.post<LoginResponse>(`${this.baseUrl}/refresh`, {
+        refresh_token: refreshToken
+      }).pipe(
+        tap({
+          next: response => this.storeTokens(response),
+          // Expired, revoked or replayed: the session is over
+          error: () => this.logout()
+        }),
+        map(response => response.access_token),
+        finalize(() => this.refreshInFlight = null),
+        shareReplay(1)
+      );
+    }
+    return this.refreshInFlight;
   }
 
   // Check if user is logged in
@@ -104,7 +222,7 @@ export class ApiService {
     }).pipe(
       tap(response => {
         if (response.access_token) {
-          this.setToken(response.access_token);
+          this.storeTokens(response);
           this.currentUserSubject.next({ username });
         }
       })
@@ -113,6 +231,11 @@ export class ApiService {
 
   // Logout
   logout(): void {
+    const refreshToken = sessionStorage.getItem(this.refreshTokenKey);
+    if (refreshToken) {
+      // Revoke server-side too; the local session ends either way
+      this.http.post(`${this.baseUrl}/logout`, { refresh_token: refreshToken }).subscribe({ error: () => {} });
+    }
     this.removeToken();
     this.currentUserSubject.next(null);
     console.log('Token removed, user logged out');
@@ -134,7 +257,14 @@ export class ApiService {
 
     return this.http.put(`${this.baseUrl}/admin/change_credentials`, body, { 
       headers: this.getHeaders() 
-    });
+    }).pipe(
+      // Credential changes revoke old tokens; keep the session on the new one
+      tap((response: any) => {
+        if (response?.access_token) {
+          this.storeTokens(response);
+        }
+      })
+    );
   }
 
   // Create new user (admin only)
@@ -147,20 +277,127 @@ export class ApiService {
     });
   }
 
-  // Get all users (admin only)
-  getAllUsers(): Observable<{ users: User[] }> {
-    return this.http.get<{ users: User[] }>(`${this.baseUrl}/users`, {
+  // Get one page of users (admin only); pass next_cursor back to continue.
+  // Rows travel in the compact columnar format and are expanded here.
+  getAllUsers(options: UserListParams = {}): Observable<UserPage> {
+    let params = new HttpParams().set('format', 'compact');
+    for (const [key, value] of Object.entries(options)) {
+      if (value !== undefined && value !== null && value !== '') {
+        params = params.set(key, String(value));
+      }
+    }
+    return this.http.get<any>(`${this.baseUrl}/users`, {
+      headers: this.getHeaders(),
+      params
+    }).pipe(map(body => expandCompact<UserPage>(body)));
+  }
+
+  // Find users by username: prefix, substring and near-miss matches (admin only)
+  searchUsers(q: string, limit = 20): Observable<{ users: User[]; query: string }> {
+    const params = new HttpParams().set('q', q).set('limit', String(limit));
+    return this.http.get<{ users: User[]; query: string }>(`${this.baseUrl}/admin/users/search`, {
+      headers: this.getHeaders(),
+      params
+    });
+  }
+
+  // Download every user as a CSV or NDJSON file (admin only)
+  exportUsers(format: 'csv' | 'ndjson' = 'csv'): Observable<Blob> {
+    return this.http.get(`${this.baseUrl}/admin/export_users`, {
+      headers: this.getHeaders(),
+      params: new HttpParams().set('format', format),
+      responseType: 'blob'
+    });
+  }
+
+  // Login successes/failures per hour or day, from server-side rollups (admin only)
+  getLoginActivity(granularity: 'hour' | 'day' = 'day', days?: number): Observable<{
+    granularity: string;
+    series: { bucket: string; successes: number; failures: number }[];
+  }> {
+    let params = new HttpParams().set('granularity', granularity);
+    if (days) {
+      params = params.set('days', String(days));
+    }
+    return this.http.get<any>(`${this.baseUrl}/admin/login_activity`, {
+      headers: this.getHeaders(),
+      params
+    });
+  }
+
+  // Counts of users inactive for 30/90/180 days or never logged in (admin only)
+  getDormantUsers(): Observable<{ dormancy: { [bucket: string]: number } }> {
+    return this.http.get<{ dormancy: { [bucket: string]: number } }>(`${this.baseUrl}/admin/dormant_users`, {
       headers: this.getHeaders()
     });
   }
 
-  // Get password reset requests (admin only)
-  getResetRequests(): Observable<{ requests: ResetRequest[] }> {
-    return this.http.get<{ requests: ResetRequest[] }>(`${this.baseUrl}/admin/forgot_requests`, {
+  // Dashboard summary counts (admin only)
+  getStats(): Observable<{ stats: DashboardStats }> {
+    return this.http.get<{ stats: DashboardStats }>(`${this.baseUrl}/admin/stats`, {
       headers: this.getHeaders()
     });
   }
 
+  // Get password reset requests (admin only). With `since`, only requests
+  // changed after that cursor are returned, including resolved ones.
+  getResetRequests(since?: number | null): Observable<{ requests: ResetRequest[]; cursor: number }> {
+    let params = new HttpParams();
+    if (since !== undefined && since !== null) {
+      params = params.set('since', String(since));
+    }
+    return this.http.get<{ requests: ResetRequest[]; cursor: number }>(`${this.baseUrl}/admin/forgot_requests`, {
+      headers: this.getHeaders(),
+      params
+    });
+  }
+
+  // Live admin events over Server-Sent Events. EventSource cannot send an
+  // Authorization header, so a short-lived stream ticket is fetched first and
+  // passed as a query parameter; the access token never goes in the URL.
+  adminEvents(): Observable<{ type: string; data: any }> {
+    return new Observable(observer => {
+      let source: EventSource | null = null;
+      const ticketSubscription = this.http.post<{ ticket: string }>(`${this.baseUrl}/admin/events/ticket`, {}, {
+        headers: this.getHeaders()
+      }).subscribe({
+        next: ({ ticket }) => {
+          source = new EventSource(`${this.baseUrl}/admin/events?ticket=${encodeURIComponent(ticket)}`);
+          const types = [
+            'forgot_request.created',
+            'forgot_request.resolved',
+            'user.created',
+            'users.imported',
+            'user.credentials_changed',
+            'sync',
+            'reset'
+          ];
+          for (const type of types) {
+            source.addEventListener(type, (event: MessageEvent) => {
+              observer.next({ type, data: JSON.parse(event.data) });
+            });
+          }
+          source.addEventListener('revoked', () => {
+            // The session was revoked; reconnecting with this ticket would fail anyway
+            source?.close();
+            observer.error(new Error('admin event stream revoked'));
+          });
+          source.onerror = () => {
+            // The browser reconnects on its own unless the server refused the stream
+            if (source?.readyState === EventSource.CLOSED) {
+              observer.error(new Error('admin event stream closed'));
+            }
+          };
+        },
+        error: (error) => observer.error(error)
+      });
+      return () => {
+        ticketSubscription.unsubscribe();
+        source?.close();
+      };
+    });
+  }
+
   // Reset user password (admin only)
   resetUserPassword(userId: number, newPassword: string, adminNote?: string): Observable<any> {
     return this.http.post(`${this.baseUrl}/admin/reset_user_password`, {
@@ -172,6 +409,18 @@ export class ApiService {
     });
   }
 
+  // Reset many users at once by ids, filter or explicit passwords (admin only)
+  batchResetPasswords(body: {
+    users?: { user_id: number; new_password?: string }[];
+    user_ids?: number[];
+    filter?: { [key: string]: string | boolean };
+    admin_note?: string;
+  }): Observable<any> {
+    return this.http.post(`${this.baseUrl}/admin/batch_reset_passwords`, body, {
+      headers: this.getHeaders()
+    });
+  }
+
   // ===== NEW USER API CALLS (Backend Integration Only) =====
 
   // User Login (Flask endpoint)
@@ -182,7 +431,7 @@ export class ApiService {
     }).pipe(
       tap(response => {
         if (response.access_token) {
-          this.setToken(response.access_token);
+          this.storeTokens(response);
           this.currentUserSubject.next({ username, isUser: true });
           console.log('User logged in, token stored');
         }
@@ -202,6 +451,13 @@ export class ApiService {
       { 
         headers: this.getHeaders()  // Added authorization header
       }
+    ).pipe(
+      // Old tokens are revoked by the password change; store the new one
+      tap((response: any) => {
+        if (response?.access_token) {
+          this.storeTokens(response);
+        }
+      })
     )
   }
 